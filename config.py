@@ -4,6 +4,9 @@ Konfigurasi Bot Telegram Ghibli Style
 File ini berisi semua parameter konfigurasi untuk GhibliBotTelegram
 """
 
+import string
+from types import MappingProxyType
+
 # Konfigurasi Bot
 BOT_CONFIG = {
     "token": "YOUR_TELEGRAM_BOT_TOKEN",
@@ -30,6 +33,15 @@ USER_ROLES = {
     }
 }
 
+# Index role dan permission, dibangun sekali saat import (lookup O(1))
+# Role yang didefinisikan lebih dulu menang jika user_id muncul di beberapa role
+ROLE_BY_USER = {}
+for _role, _data in USER_ROLES.items():
+    for _uid in _data["user_ids"]:
+        ROLE_BY_USER.setdefault(_uid, _role)
+USER_IDS_BY_ROLE = {role: frozenset(data["user_ids"]) for role, data in USER_ROLES.items()}
+PERMISSIONS_BY_ROLE = {role: frozenset(data["permissions"]) for role, data in USER_ROLES.items()}
+
 # Konfigurasi Channel dan Grup
 CHANNEL_CONFIG = {
     "required_channels": [
@@ -43,6 +55,10 @@ CHANNEL_CONFIG = {
     ]
 }
 
+# Index ID channel dan grup untuk membership test O(1)
+REQUIRED_CHANNEL_IDS = frozenset(c["id"] for c in CHANNEL_CONFIG["required_channels"])
+ALLOWED_GROUP_IDS = frozenset(g["id"] for g in CHANNEL_CONFIG["allowed_groups"])
+
 # Konfigurasi Fitur dan Limit
 FEATURE_CONFIG = {
     "daily_limit": 2,  # Limit default per hari
@@ -53,6 +69,8 @@ FEATURE_CONFIG = {
     "process_timeout": 60,  # Timeout dalam detik untuk proses generate
     "enable_watermark": True,  # Tambahkan watermark pada hasil
     "watermark_text": "@your_username",  # Teks watermark
+    "broadcast_concurrency": 25,  # Maksimum request broadcast yang berjalan bersamaan
+    "broadcast_rate": 25,  # Maksimum pesan broadcast per detik
 }
 
 # Konfigurasi Referral
@@ -77,6 +95,14 @@ STORAGE_CONFIG = {
     "backup_interval": 24,  # Interval backup dalam jam
     "keep_results": False,  # Simpan hasil generate secara permanen
     "max_results_age": 7,  # Hapus hasil setelah x hari
+    "sqlite_file": "users_data.sqlite3",  # File database SQLite
+    "use_sqlite": True,  # Pakai SQLite sebagai storage (False = file JSON lama, file JSON diimpor sekali saat pertama jalan)
+    "serializer": "orjson",  # Serializer JSON: "orjson" (fallback ke json jika tidak terinstall) atau "json"
+    "wal_mode": True,  # Aktifkan journal_mode=WAL di SQLite
+    "synchronous": "NORMAL",  # PRAGMA synchronous untuk SQLite
+    "busy_timeout_ms": 5000,  # Timeout lock SQLite dalam milidetik
+    "mmap_size": 67108864,  # PRAGMA mmap_size SQLite dalam byte (0 = nonaktif)
+    "state_file": "bot_state.pickle",  # File PicklePersistence untuk cache bot_data
 }
 
 # Konfigurasi Model AI
@@ -84,9 +110,22 @@ MODEL_CONFIG = {
     "model_id": "nitrosocke/Ghibli-Diffusion",  # ID model Diffusion
     "use_gpu": True,  # Gunakan GPU jika tersedia
     "optimize_memory": True,  # Optimize penggunaan memory
-    "enable_attention_slicing": True,  # Enable attention slicing untuk mengurangi penggunaan memory
+    "enable_attention_slicing": False,  # Mode low VRAM: attention slicing hemat memory tapi lebih lambat
     "prompt": "Ghibli-style anime painting, soft pastel colors, highly detailed, masterpiece",  # Prompt default
     "negative_prompt": "lowres, bad anatomy, bad hands, cropped, worst quality",  # Negative prompt default
+    "torch_dtype": "auto",  # Presisi weight: "auto" (bf16 jika didukung), "float16", "bfloat16" atau "float32"
+    "variant": None,  # Varian weight di repo model (mis. "fp16"), None = weight default
+    "enable_xformers": True,  # Pakai xFormers memory efficient attention jika terinstall
+    "enable_vae_tiling": True,  # Decode VAE per tile untuk hemat VRAM
+    "channels_last": True,  # Simpan weight UNet dengan memory format channels_last
+    "quantize": None,  # Kuantisasi UNet di GPU: None atau "int8" (butuh bitsandbytes)
+    "compile_unet": False,  # Compile UNet dengan torch.compile(mode="reduce-overhead")
+    "scheduler": "DPMSolverMultistepScheduler",  # Nama scheduler dari diffusers (None = bawaan model)
+    "num_inference_steps": 15,  # Jumlah langkah denoising (img2img menjalankan steps x strength)
+    "use_lcm": False,  # Pakai LCM-LoRA untuk inference beberapa langkah saja
+    "lcm_lora_id": "latent-consistency/lcm-lora-sdv1-5",  # ID LoRA LCM untuk model SD 1.5
+    "lcm_steps": 4,  # Jumlah langkah denoising saat LCM aktif
+    "max_batch_size": 4,  # Maksimum request yang digabung dalam satu batch inference
 }
 
 # Konfigurasi Bot Messages
@@ -103,8 +142,34 @@ MESSAGES = {
     "referral_info": "🔗 Link referral kamu: {referral_link}\n\nSetiap orang yang pakai link kamu akan dapat +1 limit, dan kamu dapat +2 limit untuk setiap orang yang menggunakan link kamu!",
 }
 
-# Export all config as a dictionary for easy access
-CONFIG = {
+# Normalisasi batas strength ke float sekali saat import
+for _key in ("min_strength", "max_strength", "default_strength"):
+    FEATURE_CONFIG[_key] = float(FEATURE_CONFIG[_key])
+
+def _freeze(d):
+    """Bungkus dict secara rekursif jadi read-only view (list diubah jadi tuple)"""
+    return MappingProxyType({
+        k: _freeze(v) if isinstance(v, dict) else (
+            tuple(_freeze(x) if isinstance(x, dict) else x for x in v) if isinstance(v, list) else v
+        )
+        for k, v in d.items()
+    })
+
+# Bekukan semua konfigurasi supaya aman di-share antar handler tanpa defensive copy
+BOT_CONFIG = _freeze(BOT_CONFIG)
+USER_ROLES = _freeze(USER_ROLES)
+ROLE_BY_USER = _freeze(ROLE_BY_USER)
+USER_IDS_BY_ROLE = _freeze(USER_IDS_BY_ROLE)
+PERMISSIONS_BY_ROLE = _freeze(PERMISSIONS_BY_ROLE)
+CHANNEL_CONFIG = _freeze(CHANNEL_CONFIG)
+FEATURE_CONFIG = _freeze(FEATURE_CONFIG)
+REFERRAL_CONFIG = _freeze(REFERRAL_CONFIG)
+STORAGE_CONFIG = _freeze(STORAGE_CONFIG)
+MODEL_CONFIG = _freeze(MODEL_CONFIG)
+MESSAGES = _freeze(MESSAGES)
+
+# Export all config as a read-only mapping for easy access
+CONFIG = _freeze({
     "bot": BOT_CONFIG,
     "users": USER_ROLES,
     "channels": CHANNEL_CONFIG,
@@ -113,4 +178,32 @@ CONFIG = {
     "storage": STORAGE_CONFIG,
     "model": MODEL_CONFIG,
     "messages": MESSAGES,
-}
+    "indexes": {
+        "role_by_user": ROLE_BY_USER,
+        "user_ids_by_role": USER_IDS_BY_ROLE,
+        "permissions_by_role": PERMISSIONS_BY_ROLE,
+        "required_channel_ids": REQUIRED_CHANNEL_IDS,
+        "allowed_group_ids": ALLOWED_GROUP_IDS,
+    },
+})
+
+# Template pesan di-parse sekali saat import, render cukup join literal + substitusi field
+_MESSAGE_PARTS = {k: tuple(string.Formatter().parse(v)) for k, v in MESSAGES.items()}
+
+def render(key: str, **kwargs) -> str:
+    """Render pesan dari MESSAGES dengan placeholder {nama} (tanpa format spec)"""
+    return "".join(
+        literal + (str(kwargs[field]) if field is not None else "")
+        for literal, field, _, _ in _MESSAGE_PARTS[key]
+    )
+
+# Template link referral dengan username bot yang sudah di-bake saat import
+_REF_TEMPLATE = REFERRAL_CONFIG["referral_link_format"].replace("{bot_username}", BOT_CONFIG["username"])
+
+def build_referral_link(user_id: int) -> str:
+    """Buat link referral untuk user dari template yang sudah disiapkan"""
+    return _REF_TEMPLATE.replace("{user_id}", str(user_id))
+
+def clamp_strength(x: float, _lo: float = FEATURE_CONFIG["min_strength"], _hi: float = FEATURE_CONFIG["max_strength"]) -> float:
+    """Batasi strength ke rentang min_strength..max_strength"""
+    return _lo if x < _lo else _hi if x > _hi else x
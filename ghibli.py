@@ -9,16 +9,21 @@ Fitur:
 """
 
 import logging
-import os
+import pathlib
 import time
 import asyncio
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Union
+import concurrent.futures
+import functools
+import html
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 from PIL import Image
 import io
-from diffusers import StableDiffusionImg2ImgPipeline
+import diffusers
+from diffusers import LCMScheduler, StableDiffusionImg2ImgPipeline
+from diffusers.models.attention_processor import AttnProcessor2_0
 
 from telegram import (
     Update, 
@@ -30,10 +35,13 @@ from telegram import (
     ParseMode,
     Message
 )
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    PicklePersistence,
     CallbackQueryHandler,
     ConversationHandler,
     filters,
@@ -41,7 +49,7 @@ from telegram.ext import (
 )
 
 # Import konfigurasi dan utilitas
-from config import CONFIG
+from config import CONFIG, render, clamp_strength
 import utils
 
 # Setup logging
@@ -51,95 +59,534 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Binding konfigurasi yang sering dipakai di handler (sekali saat import)
+_MSG = CONFIG["messages"]
+_FEATURES = CONFIG["features"]
+_DAILY_LIMIT = _FEATURES["daily_limit"]
+_DEFAULT_STRENGTH = _FEATURES["default_strength"]
+_RESULT_FOLDER = pathlib.Path(CONFIG["storage"]["result_folder"])
+_REFEREE_BONUS = CONFIG["referral"]["referee_bonus"]
+_REFERRER_BONUS = CONFIG["referral"]["referrer_bonus"]
+_MIN_USES = CONFIG["referral"]["min_uses_for_extra_bonus"]
+_EXTRA_BONUS = CONFIG["referral"]["extra_bonus"]
+_BOT_NAME = CONFIG["bot"]["name"]
+_BOT_USERNAME = CONFIG["bot"]["username"]
+_BOT_VERSION = CONFIG["bot"]["version"]
+_RELEASE_DATE = CONFIG["bot"]["release_date"]
+_MODEL_NAME = CONFIG["model"]["model_id"].split("/")[-1]
+
+# Template pesan menu utama, tinggal diisi bagian yang dinamis
+_WELCOME_TMPL = (
+    "*{welcome}*\n\n"
+    f"*Limit harian lo:* `{{remaining}}/{_DAILY_LIMIT}` foto\n"
+    "*Terakhir generate:* {ago}\n\n"
+    "```\n🔥 Pilih menu di bawah untuk mulai pakai fitur bot 🔥\n```"
+)
+
+# Menu utama untuk user yang belum terdaftar (tanpa info limit)
+_WELCOME_NO_LIMIT_TMPL = (
+    "*{welcome}*\n\n"
+    "```\n🔥 Pilih menu di bawah untuk mulai pakai fitur bot 🔥\n```"
+)
+
+# Teks statis tutorial dan about dalam HTML, dirangkai sekali saat import
+_CHANNEL_LINKS_HTML = "\n".join(
+    f'{i}. <a href="{html.escape(c["link"])}">{html.escape(c["username"])}</a>'
+    + (f' - <i>{html.escape(c["description"])}</i>' if c.get("description") else "")
+    for i, c in enumerate(CONFIG["channels"]["required_channels"], 1)
+)
+
+_TUTORIAL_TEXT = (
+    "<b>📚 TUTORIAL GHIBLIBOT 📚</b>\n\n"
+    "<b>Cara Pakai Bot:</b>\n"
+    "1️⃣ Join ketiga channel yang diperlukan:\n"
+    f"{_CHANNEL_LINKS_HTML}\n\n"
+    "2️⃣ Pastikan lo ada di grup yang diizinkan\n\n"
+    "3️⃣ Kirim foto dengan caption <code>/ghibli</code>\n\n"
+    "4️⃣ Tunggu proses selesai (biasanya 10-30 detik)\n\n"
+    "5️⃣ Tadaaa! Foto lo udah berubah jadi style Ghibli!\n\n"
+    f"<i>Note: Lo punya limit {_DAILY_LIMIT} foto per hari. Limit reset jam 00:00 WIB.</i>\n\n"
+    
+    "<b>🔗 SISTEM REFERRAL 🔗</b>\n"
+    "- Klik menu 'Referral' untuk mendapatkan link referral kamu\n"
+    "- Share link ke teman untuk mendapatkan bonus limit:\n"
+    f"  • Teman dapat bonus +{_REFEREE_BONUS} limit\n"
+    f"  • Kamu dapat bonus +{_REFERRER_BONUS} limit\n"
+    f"  • Jika {_MIN_USES}+ orang pakai link kamu, dapat bonus tambahan +{_EXTRA_BONUS} limit\n\n"
+    
+    "<b>💡 Tips:</b>\n"
+    "- Hasil terbaik untuk foto dengan pencahayaan bagus\n"
+    "- Hindari foto yang terlalu gelap atau blur\n"
+    "- Foto wajah close-up biasanya memberikan hasil terbaik!"
+)
+
+_ABOUT_TEXT = (
+    "<b>🤖 TENTANG GHIBLIBOT 🤖</b>\n\n"
+    f"{html.escape(_BOT_NAME)} adalah bot keren yang mengubah foto biasa menjadi karya seni bergaya Studio Ghibli. Bot ini menggunakan teknologi AI canggih untuk menghasilkan transformasi foto yang memukau.\n\n"
+    
+    "<b>🌟 FITUR 🌟</b>\n"
+    "• Transformasi foto ke style Ghibli\n"
+    "• Proses super cepat dengan GPU\n"
+    "• Interface yang user-friendly\n"
+    "• Sistem referral untuk bonus limit\n"
+    "• Statistik penggunaan\n"
+    "• Sistem limit harian\n\n"
+    
+    "<b>👨‍💻 DEVELOPER 👨‍💻</b>\n"
+    f"Bot ini dibuat oleh @{html.escape(_BOT_USERNAME)}\n\n"
+    
+    "<b>📢 CHANNEL &amp; GRUP 📢</b>\n"
+    f"{_CHANNEL_LINKS_HTML}\n\n"
+    
+    "<b>📝 VERSI BOT 📝</b>\n"
+    f"Version: <code>{html.escape(_BOT_VERSION)}</code>\n"
+    f"Last Update: <code>{html.escape(_RELEASE_DATE)}</code>\n\n"
+    
+    f"<i>Thanks for using {html.escape(_BOT_NAME)}!</i> ❤️"
+)
+
+# Template instruksi generate, tinggal diisi sisa limit
+_INSTRUCTIONS_TMPL = (
+    "*📸 Cara Generate Foto Ghibli 📸*\n\n"
+    "1️⃣ Kirim foto di *grup yang diizinkan*\n"
+    "2️⃣ Tambahkan caption `/ghibli`\n"
+    "3️⃣ Tunggu sampai proses selesai\n\n"
+    f"*Limit tersisa:* `{{remaining}}/{_DAILY_LIMIT}` foto\n\n"
+    "_Catatan: Foto lo bakal diubah ke style Studio Ghibli yang keren abis!_ ✨"
+)
+
+def welcome_greeting(first_name: str) -> str:
+    """Render sapaan welcome dengan nama user yang sudah di-escape untuk Markdown"""
+    return render("welcome", first_name=escape_markdown(first_name or "", version=1))
+
+def welcome_text(first_name: str, user_data: Dict) -> str:
+    """Render pesan menu utama untuk user"""
+    return _WELCOME_TMPL.format(
+        welcome=welcome_greeting(first_name),
+        remaining=user_data["remaining_limit"],
+        ago=utils.format_time_ago(user_data.get("last_generation_time", None))
+    )
+
+# ============== KEYBOARD ==============
+
+# Keyboard statis dibuat sekali saat import dan dipakai ulang di semua handler
+# Menu utama
+_KB_MAIN_MENU = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📸 Mulai Generate", callback_data="start_generate"),
+        InlineKeyboardButton("ℹ️ Tutorial", callback_data="tutorial")
+    ],
+    [
+        InlineKeyboardButton("🏆 Top Users", callback_data="top_users"),
+        InlineKeyboardButton("📊 Statistik", callback_data="stats")
+    ],
+    [
+        InlineKeyboardButton("🔗 Referral", callback_data="referral"),
+        InlineKeyboardButton("🤖 About Bot", callback_data="about")
+    ]
+])
+# Tombol kembali ke menu
+_KB_BACK_ONLY = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
+])
+# Navigasi leaderboard
+_KB_TOP_NAV = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("👥 Top Users", callback_data="top_users"),
+        InlineKeyboardButton("🔗 Top Referrers", callback_data="top_referrers")
+    ],
+    [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
+])
+# Cek ulang subscription + kembali
+_KB_CHECK_SUB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Sudah Join Semua", callback_data="check_subscription")],
+    [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
+])
+# Cek ulang subscription (dari command /ghibli)
+_KB_CHECK_SUB_ONLY = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Sudah Join Semua", callback_data="check_subscription")]
+])
+# Limit habis (dari menu)
+_KB_LIMIT_EXCEEDED = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔄 Cek Limit", callback_data="check_limit"),
+        InlineKeyboardButton("🔗 Referral", callback_data="referral")
+    ],
+    [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
+])
+# Limit habis (dari command /ghibli)
+_KB_CHECK_LIMIT_ONLY = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Cek Limit", callback_data="check_limit")]
+])
+# Info limit
+_KB_REFERRAL_BACK = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔗 Dapatkan Link Referral", callback_data="referral")],
+    [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
+])
+# Di bawah hasil generate
+_KB_RESULT = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔄 Bikin Lagi", callback_data="start_generate"),
+        InlineKeyboardButton("🔗 Share Referral", callback_data="referral")
+    ],
+    [InlineKeyboardButton("🏠 Menu Utama", callback_data="back_to_menu")]
+])
+
 # Variabel global untuk model
 model = None
 
+# Pinned host buffer untuk input tensor (dialokasikan saat batch pertama di CUDA)
+input_buffer = None
+
+# Executor satu thread khusus model, semua panggilan GPU berjalan berurutan
+model_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ghibli-infer")
+
+# Antrian request generate, dikonsumsi oleh satu inference_loop
+inference_queue: asyncio.Queue = asyncio.Queue()
+
 # State untuk conversation handler
 WAITING_FOR_PHOTO, PROCESSING = range(2)
 
 # ============== MODEL AI FUNCTIONS ==============
 
+def sampling_kwargs() -> Dict:
+    """Parameter sampling pipeline (jumlah langkah, guidance) sesuai mode model"""
+    if CONFIG["model"]["use_lcm"]:
+        # LCM cukup beberapa langkah dan tidak butuh classifier-free guidance
+        return {"num_inference_steps": CONFIG["model"]["lcm_steps"], "guidance_scale": 1.0}
+    return {"num_inference_steps": CONFIG["model"]["num_inference_steps"]}
+
+def resolve_dtype(device: str):
+    """Tentukan dtype model berdasarkan konfigurasi dan kemampuan hardware"""
+    dtype_name = CONFIG["model"]["torch_dtype"]
+    
+    if dtype_name == "auto":
+        if device == "cuda":
+            # BF16 di Ampere+ (range sama dengan fp32, tidak overflow seperti fp16)
+            return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        is_amx_supported = getattr(torch.cpu, "_is_amx_tile_supported", None)
+        return torch.bfloat16 if is_amx_supported is not None and is_amx_supported() else torch.float32
+    
+    dtype = getattr(torch, dtype_name)
+    # FP16 di CPU lambat dan banyak op yang tidak tersedia
+    if device == "cpu" and dtype == torch.float16:
+        return torch.float32
+    return dtype
+
 def load_model():
     """Load model Ghibli-Diffusion"""
     model_id = CONFIG["model"]["model_id"]
     use_gpu = CONFIG["model"]["use_gpu"]
+    device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
     
-    dtype = torch.float16 if use_gpu and torch.cuda.is_available() else torch.float32
-    logger.info("🔄 Loading Ghibli-Diffusion model...")
+    if device == "cuda":
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+    
+    dtype = resolve_dtype(device)
+    logger.info(f"🔄 Loading Ghibli-Diffusion model ({dtype})...")
+    
+    # Kuantisasi UNet ke int8 (bitsandbytes) untuk memangkas bytes per langkah
+    pipeline_kwargs = {}
+    quantized = device == "cuda" and CONFIG["model"]["quantize"] == "int8"
+    if quantized:
+        from diffusers import BitsAndBytesConfig, UNet2DConditionModel
+        pipeline_kwargs["unet"] = UNet2DConditionModel.from_pretrained(
+            model_id,
+            subfolder="unet",
+            quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+            torch_dtype=dtype
+        )
     
-    pipe = StableDiffusionImg2ImgPipeline.from_pretrained(model_id, torch_dtype=dtype)
-    device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+    pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
+        model_id,
+        torch_dtype=dtype,
+        variant=CONFIG["model"]["variant"],
+        **pipeline_kwargs
+    )
     pipe.to(device)
     
+    # LCM-LoRA: distilasi untuk inference ~4 langkah
+    if CONFIG["model"]["use_lcm"]:
+        pipe.load_lora_weights(CONFIG["model"]["lcm_lora_id"])
+        pipe.fuse_lora()
+        pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
+    
+    # Ganti scheduler, DPM-Solver++ (Karras) butuh jauh lebih sedikit langkah
+    scheduler_name = CONFIG["model"]["scheduler"]
+    if scheduler_name and not CONFIG["model"]["use_lcm"]:
+        scheduler_kwargs = {}
+        if scheduler_name == "DPMSolverMultistepScheduler":
+            scheduler_kwargs = {"use_karras_sigmas": True, "algorithm_type": "sde-dpmsolver++"}
+        scheduler_cls = getattr(diffusers, scheduler_name)
+        pipe.scheduler = scheduler_cls.from_config(pipe.scheduler.config, **scheduler_kwargs)
+    
+    # Memory efficient attention dari xFormers jika tersedia
+    xformers_enabled = False
+    if device == "cuda" and CONFIG["model"]["enable_xformers"]:
+        try:
+            import xformers.ops  # noqa: F401
+            pipe.enable_xformers_memory_efficient_attention()
+            xformers_enabled = True
+        except Exception as e:
+            logger.warning(f"xFormers tidak tersedia, pakai attention bawaan: {e}")
+    
+    # Fused scaled_dot_product_attention PyTorch 2 (FlashAttention di CUDA)
+    if not xformers_enabled:
+        pipe.unet.set_attn_processor(AttnProcessor2_0())
+        pipe.vae.set_attn_processor(AttnProcessor2_0())
+    
+    # Attention slicing cuma untuk mode low VRAM (lebih lambat ~20%)
     if CONFIG["model"]["enable_attention_slicing"]:
         pipe.enable_attention_slicing()  # Optimize memory usage
     
+    if CONFIG["model"]["enable_vae_tiling"]:
+        pipe.enable_vae_tiling()
+    
+    # Weight int8 bitsandbytes tidak bisa dipindah memory format-nya
+    if CONFIG["model"]["channels_last"] and not quantized:
+        pipe.unet.to(memory_format=torch.channels_last)
+    
+    # Compile UNet dan VAE decoder (PyTorch 2.0+) untuk fused kernel
+    if CONFIG["model"]["compile_unet"] and hasattr(torch, "compile"):
+        logger.info("🔧 Compiling UNet...")
+        pipe.unet = torch.compile(pipe.unet, mode="reduce-overhead", fullgraph=True)
+        pipe.vae.decode = torch.compile(pipe.vae.decode, mode="reduce-overhead")
+    
     logger.info(f"✅ Model loaded on {device}!")
     return pipe
 
-async def generate_ghibli_image(image, strength=None):
-    """Generate gambar gaya Ghibli dari input image"""
+def images_to_tensor(images: List[Image.Image]) -> torch.Tensor:
+    """Konversi batch gambar 512x512 ke tensor [0, 1] di device model lewat pinned buffer"""
+    global input_buffer
+    
+    device = model.device
+    dtype = model.unet.dtype
+    
+    # NHWC uint8 -> NCHW float di rentang [0, 1], normalisasi ke [-1, 1] dilakukan sekali oleh pipeline
+    batch = np.stack([np.asarray(image, dtype=np.float32) for image in images])
+    batch = torch.from_numpy(batch).permute(0, 3, 1, 2).div_(255.0)
+    
+    if device.type != "cuda":
+        return batch.to(dtype)
+    
+    # Copy H2D dari pinned memory (DMA) dan non-blocking
+    if input_buffer is None or input_buffer.dtype != dtype:
+        input_buffer = torch.empty(
+            (CONFIG["model"]["max_batch_size"], 3, 512, 512),
+            dtype=dtype,
+            pin_memory=True
+        )
+    staging = input_buffer[:len(images)]
+    staging.copy_(batch)
+    return staging.to(device, non_blocking=True)
+
+def run_pipeline(images: List[Image.Image], strength: float, on_step: Optional[Callable[[int], None]] = None):
+    """Jalankan pipeline untuk satu batch gambar (dipanggil dari thread inference)"""
+    batch_size = len(images)
+    
+    def step_end_callback(pipe, step, timestep, callback_kwargs):
+        # Laporkan progress asli kira-kira tiap sepertiga langkah denoising
+        total_steps = pipe.num_timesteps
+        interval = max(1, total_steps // 3)
+        if on_step is not None and (step + 1) % interval == 0 and step + 1 < total_steps:
+            on_step(int((step + 1) * 100 / total_steps))
+        return callback_kwargs
+    
+    return model(
+        prompt=[CONFIG["model"]["prompt"]] * batch_size,
+        image=images_to_tensor(images),
+        strength=strength,
+        negative_prompt=[CONFIG["model"]["negative_prompt"]] * batch_size,
+        **sampling_kwargs(),
+        callback_on_step_end=step_end_callback,
+        callback_on_step_end_tensor_inputs=[]
+    )
+
+def warm_up_model() -> None:
+    """Jalankan pipeline sekali untuk tiap ukuran batch supaya compile dan CUDA graph sudah siap"""
+    if not CONFIG["model"]["compile_unet"]:
+        return
+    
+    # Compile mode reduce-overhead merekam ulang graph untuk tiap shape baru, jadi semua ukuran batch dipanaskan
+    image = Image.new("RGB", (512, 512))
+    for batch_size in range(1, CONFIG["model"]["max_batch_size"] + 1):
+        logger.info(f"🔥 Warming up batch size {batch_size}...")
+        run_pipeline([image] * batch_size, _DEFAULT_STRENGTH)
+
+async def run_inference_batch(items: List[Tuple]) -> None:
+    """Jalankan satu batch request dengan strength yang sama dalam satu panggilan pipeline"""
     global model
     
+    futures = [future for _, _, future, _ in items]
+    progress_callbacks = [on_progress for _, _, _, on_progress in items if on_progress is not None]
+    loop = asyncio.get_running_loop()
+    
+    def on_step(percent: int) -> None:
+        # Dipanggil dari thread inference, jadwalkan update ke event loop
+        for on_progress in progress_callbacks:
+            asyncio.run_coroutine_threadsafe(on_progress(percent), loop)
+    
+    try:
+        # Load model jika belum
+        if model is None:
+            model = await loop.run_in_executor(model_executor, load_model)
+            await loop.run_in_executor(model_executor, warm_up_model)
+        
+        batch_size = len(items)
+        strength = items[0][1]
+        logger.info(f"🎨 Generating {batch_size} Ghibli image(s)...")
+        start_time = time.time()
+        
+        # Execute model in thread pool to avoid blocking
+        result = await loop.run_in_executor(
+            model_executor,
+            functools.partial(run_pipeline, [image for image, _, _, _ in items], strength, on_step)
+        )
+        
+        process_time = time.time() - start_time
+        logger.info(f"✨ {batch_size} image(s) generated in {process_time:.2f} seconds!")
+        
+        for future, result_image in zip(futures, result.images):
+            if not future.done():
+                future.set_result((result_image, process_time))
+    except Exception as e:
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+
+async def inference_loop() -> None:
+    """Loop tunggal yang memegang model dan memproses antrian generate secara FIFO"""
+    max_batch = CONFIG["model"]["max_batch_size"]
+    
+    while True:
+        # Tunggu request pertama, lalu ambil request lain yang sudah antri (non-blocking)
+        batch = [await inference_queue.get()]
+        while len(batch) < max_batch and not inference_queue.empty():
+            batch.append(inference_queue.get_nowait())
+        
+        # Strength di pipeline berupa scalar, jadi batch dipecah per strength
+        groups: Dict[float, List[Tuple]] = {}
+        for item in batch:
+            groups.setdefault(item[1], []).append(item)
+        
+        try:
+            for items in groups.values():
+                await run_inference_batch(items)
+        finally:
+            for _ in batch:
+                inference_queue.task_done()
+
+async def generate_ghibli_image(image, strength=None, on_progress=None):
+    """Generate gambar gaya Ghibli dari input image lewat antrian inference
+    
+    on_progress (opsional) adalah coroutine function yang dipanggil dengan persentase progress
+    """
     # Use default strength if not specified
     if strength is None:
-        strength = CONFIG["features"]["default_strength"]
+        strength = _DEFAULT_STRENGTH
     
     # Clamp strength to valid range
-    strength = max(CONFIG["features"]["min_strength"], 
-                   min(CONFIG["features"]["max_strength"], strength))
-    
-    # Load model jika belum
-    if model is None:
-        model = load_model()
+    strength = clamp_strength(strength)
     
     # Preprocess image
     image = image.convert("RGB")
-    image = image.resize((512, 512))  # Pastikan ukuran yang tepat
-    
-    # Prompt dari konfigurasi
-    prompt = CONFIG["model"]["prompt"]
-    negative_prompt = CONFIG["model"]["negative_prompt"]
+    image = image.resize((512, 512), Image.Resampling.LANCZOS)  # Pastikan ukuran yang tepat
     
-    logger.info("🎨 Generating Ghibli image...")
-    start_time = time.time()
+    future = asyncio.get_running_loop().create_future()
+    await inference_queue.put((image, strength, future, on_progress))
     
-    # Execute model in thread pool to avoid blocking
-    result = await asyncio.to_thread(
-        model, 
-        prompt=prompt, 
-        image=image, 
-        strength=strength,
-        negative_prompt=negative_prompt
-    )
-    
-    process_time = time.time() - start_time
-    logger.info(f"✨ Image generated in {process_time:.2f} seconds!")
-    
-    # Get first image from result
-    result_image = result.images[0]
-    
-    return result_image, process_time
+    return await future
 
 # ============== SUBSCRIPTION CHECK ==============
 
+# Status member yang dianggap sudah join: 'creator', 'administrator', 'member'
+_JOINED_STATUSES = frozenset((ChatMember.CREATOR, ChatMember.ADMINISTRATOR, ChatMember.MEMBER))
+
 async def check_user_subscriptions(bot: Bot, user_id: int) -> Tuple[bool, List[Dict]]:
     """Cek status subscription user ke channel yang diperlukan"""
     not_joined = []
+    channels = CONFIG["channels"]["required_channels"]
     
-    for channel in CONFIG["channels"]["required_channels"]:
-        try:
-            member = await bot.get_chat_member(chat_id=channel["id"], user_id=user_id)
-            status = member.status
-            # Status valid: 'creator', 'administrator', 'member'
-            if status not in [ChatMember.CREATOR, ChatMember.ADMINISTRATOR, ChatMember.MEMBER]:
-                not_joined.append(channel)
-        except Exception as e:
-            logger.error(f"Error saat cek membership: {e}")
+    # Cek semua channel secara paralel
+    results = await asyncio.gather(
+        *[bot.get_chat_member(chat_id=channel["id"], user_id=user_id) for channel in channels],
+        return_exceptions=True
+    )
+    
+    for channel, member in zip(channels, results):
+        if isinstance(member, Exception):
+            logger.error(f"Error saat cek membership: {member}")
+            not_joined.append(channel)
+        elif member.status not in _JOINED_STATUSES:
             not_joined.append(channel)
     
     return len(not_joined) == 0, not_joined
 
+# Cache hasil cek subscription di bot_data["sub_cache"]: user_id -> (waktu cek, subscribed, id channel belum join)
+_SUB_CACHE_TTL = 60
+
+async def cached_check_sub(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> Tuple[bool, List[Dict]]:
+    """Cek subscription user dengan cache TTL supaya tidak memanggil getChatMember tiap klik"""
+    cache = context.bot_data.setdefault("sub_cache", {})
+    now = time.time()
+    hit = cache.get(user_id)
+    if hit and now - hit[0] < _SUB_CACHE_TTL:
+        return hit[1], [c for c in CONFIG["channels"]["required_channels"] if c["id"] in hit[2]]
+    
+    subscribed, not_joined = await check_user_subscriptions(context.bot, user_id)
+    # Simpan ID channel saja (config berupa mappingproxy yang tidak bisa di-pickle)
+    cache[user_id] = (now, subscribed, tuple(c["id"] for c in not_joined))
+    return subscribed, not_joined
+
+async def trim_sub_cache(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job berkala untuk membuang hasil cek subscription yang sudah kedaluwarsa"""
+    cache = context.bot_data.setdefault("sub_cache", {})
+    cutoff = time.time() - _SUB_CACHE_TTL
+    for key in [k for k, hit in cache.items() if hit[0] < cutoff]:
+        del cache[key]
+
+# ============== LEADERBOARD ==============
+
+# Cache teks leaderboard di bot_data["top_cache"]: jenis -> (waktu render, teks)
+_TOP_CACHE_TTL = 30
+
+# Definisi leaderboard: jenis -> (list di stats, judul, teks kosong, field skor, satuan)
+_TOP_VIEWS = {
+    "users": ("top_users", "*🏆 TOP 10 USERS 🏆*", "_Belum ada data pengguna._", "total_generations", "generate"),
+    "referrers": ("top_referrers", "*🔗 TOP 10 REFERRERS 🔗*", "_Belum ada data referral._", "total_referrals", "referrals"),
+}
+
+def build_top_text(db: Dict, kind: str) -> str:
+    """Render teks leaderboard dari statistik database"""
+    list_name, title, empty_text, sort_key, unit = _TOP_VIEWS[kind]
+    entries = db["stats"].get(list_name)
+    
+    if not entries:
+        return f"{title}\n\n{empty_text}\n"
+    
+    lines = [f"{title}\n"]
+    for i, user_stat in enumerate(entries, 1):
+        name = user_stat["first_name"] or user_stat["username"] or f"User {user_stat['user_id']}"
+        lines.append(f"{i}. {name}: `{user_stat[sort_key]}` {unit}")
+    return "\n".join(lines) + "\n"
+
+def cached_top_text(context: ContextTypes.DEFAULT_TYPE, kind: str) -> str:
+    """Ambil teks leaderboard dari cache, render ulang jika sudah lebih dari 30 detik"""
+    cache = context.bot_data.setdefault("top_cache", {})
+    now = time.time()
+    hit = cache.get(kind)
+    if hit and now - hit[0] < _TOP_CACHE_TTL:
+        return hit[1]
+    
+    text = build_top_text(utils.load_database(), kind)
+    cache[kind] = (now, text)
+    return text
+
+def invalidate_top_cache(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Paksa leaderboard dirender ulang pada request berikutnya"""
+    context.bot_data.pop("top_cache", None)
+
 # ============== COMMAND HANDLERS ==============
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -157,7 +604,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             if success:
                 # Kirim pesan ke referee (user baru)
                 referrer_name = utils.get_referrer_name(int(referrer_data["user_id"]))
-                referee_msg = CONFIG["messages"]["referral_welcome"].format(referrer_name=referrer_name)
+                referee_msg = render("referral_welcome", referrer_name=escape_markdown(referrer_name, version=1))
                 await update.message.reply_text(
                     f"{referee_msg}\n\n",
                     parse_mode=ParseMode.MARKDOWN
@@ -166,7 +613,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 # Kirim pesan ke referrer
                 try:
                     referee_name = user.first_name or f"@{user.username}" if user.username else f"User {user.id}"
-                    referrer_msg = CONFIG["messages"]["referral_success"].format(referee_name=referee_name)
+                    referrer_msg = render("referral_success", referee_name=escape_markdown(referee_name, version=1))
                     await context.bot.send_message(
                         chat_id=int(referrer_data["user_id"]),
                         text=referrer_msg,
@@ -185,29 +632,10 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     utils.update_user_data(user.id, user_data)
     
     # Membuat keyboard untuk menu utama
-    keyboard = [
-        [
-            InlineKeyboardButton("📸 Mulai Generate", callback_data="start_generate"),
-            InlineKeyboardButton("ℹ️ Tutorial", callback_data="tutorial")
-        ],
-        [
-            InlineKeyboardButton("🏆 Top Users", callback_data="top_users"),
-            InlineKeyboardButton("📊 Statistik", callback_data="stats")
-        ],
-        [
-            InlineKeyboardButton("🔗 Referral", callback_data="referral"),
-            InlineKeyboardButton("🤖 About Bot", callback_data="about")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_MAIN_MENU
     
     # Pesan selamat datang dengan format Telegram
-    welcome_message = (
-        f"*{CONFIG['messages']['welcome']}*\n\n"
-        f"*Limit harian lo:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}` foto\n"
-        f"*Terakhir generate:* {utils.format_time_ago(user_data.get('last_generation_time', None))}\n\n"
-        f"```\n🔥 Pilih menu di bawah untuk mulai pakai fitur bot 🔥\n```"
-    )
+    welcome_message = welcome_text(user.first_name, user_data)
     
     await update.message.reply_text(
         welcome_message,
@@ -243,8 +671,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
     
     # Tambah tombol untuk kembali ke menu utama
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
     await update.message.reply_text(
         help_text,
@@ -260,17 +687,13 @@ async def limit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     limit_text = (
         f"*📊 INFO LIMIT KAMU 📊*\n\n"
         f"👤 *User:* {user.first_name}\n"
-        f"🎯 *Limit tersisa:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}` per hari\n"
+        f"🎯 *Limit tersisa:* `{user_data['remaining_limit']}/{_DAILY_LIMIT}` per hari\n"
         f"🕒 *Reset limit:* Setiap jam 00:00 WIB\n"
         f"🔄 *Terakhir generate:* {utils.format_time_ago(user_data.get('last_generation_time', None))}\n\n"
         f"_Tips: Undang temen dengan link referral untuk nambah limit!_ 🔗"
     )
     
-    keyboard = [
-        [InlineKeyboardButton("🔗 Dapatkan Link Referral", callback_data="referral")],
-        [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_REFERRAL_BACK
     
     await update.message.reply_text(
         limit_text,
@@ -303,8 +726,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         name = user_stat["first_name"] or user_stat["username"] or f"User {user_stat['user_id']}"
         stats_text += f"{i}. {name}: `{user_stat['total_generations']}` generate\n"
     
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
     await update.message.reply_text(
         stats_text,
@@ -320,16 +742,15 @@ async def referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     
     referral_text = (
         f"*🔗 LINK REFERRAL KAMU 🔗*\n\n"
-        f"{CONFIG['messages']['referral_info'].format(referral_link=referral_link)}\n\n"
+        f"{render('referral_info', referral_link=referral_link)}\n\n"
         f"*Statistik Referral Kamu:*\n"
         f"👥 *Orang yang diundang:* `{len(user_data['referral']['referred_users'])}`\n"
-        f"🎁 *Total bonus:* `{user_data['referral']['total_referrals'] * CONFIG['referral']['referrer_bonus']}`\n"
-        f"🔥 *Bonus spesial:* `{'Sudah diklaim' if user_data['referral']['bonus_claimed'] else f'Belum (butuh {CONFIG['referral']['min_uses_for_extra_bonus']} undangan)'}`\n\n"
+        f"🎁 *Total bonus:* `{user_data['referral']['total_referrals'] * _REFERRER_BONUS}`\n"
+        f"🔥 *Bonus spesial:* `{'Sudah diklaim' if user_data['referral']['bonus_claimed'] else f'Belum (butuh {_MIN_USES} undangan)'}`\n\n"
         f"_Share link ini ke teman-temanmu untuk dapatkan bonus limit!_ 🚀"
     )
     
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
     await update.message.reply_text(
         referral_text,
@@ -462,21 +883,34 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         parse_mode=ParseMode.MARKDOWN
     )
     
-    # Kirim pesan ke semua user
-    for user_id in db["users"]:
-        try:
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text=f"*📢 BROADCAST MESSAGE 📢*\n\n{broadcast_message}",
-                parse_mode=ParseMode.MARKDOWN
-            )
-            user_count += 1
+    # Kirim paralel dengan batas concurrency, dan jadwal kirim dipacing
+    # supaya throughput tetap di bawah rate limit Telegram
+    semaphore = asyncio.Semaphore(_FEATURES["broadcast_concurrency"])
+    interval = 1 / _FEATURES["broadcast_rate"]
+    loop = asyncio.get_running_loop()
+    next_slot = loop.time()
+    
+    async def send_one(user_id: str) -> None:
+        nonlocal next_slot, user_count
+        async with semaphore:
+            now = loop.time()
+            delay = next_slot - now
+            next_slot = max(now, next_slot) + interval
+            if delay > 0:
+                await asyncio.sleep(delay)
             
-            # Sleep untuk menghindari rate limit
-            if user_count % 20 == 0:
-                await asyncio.sleep(1)
-        except Exception as e:
-            logger.error(f"Error saat broadcast ke user {user_id}: {e}")
+            try:
+                await context.bot.send_message(
+                    chat_id=int(user_id),
+                    text=f"*📢 BROADCAST MESSAGE 📢*\n\n{broadcast_message}",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                user_count += 1
+            except Exception as e:
+                logger.error(f"Error saat broadcast ke user {user_id}: {e}")
+    
+    # Kirim pesan ke semua user
+    await asyncio.gather(*(send_one(user_id) for user_id in list(db["users"])))
     
     await update.message.reply_text(
         f"✅ *Broadcast selesai!*\n\n"
@@ -581,6 +1015,27 @@ async def user_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # ============== GHIBLI GENERATION HANDLER ==============
 
+def encode_jpeg(image: Image.Image) -> io.BytesIO:
+    """Encode gambar hasil ke JPEG di memory"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92, optimize=False)
+    buffer.seek(0)
+    return buffer
+
+def progress_text(percent: int) -> str:
+    """Format pesan proses dengan progress bar"""
+    filled = percent // 10
+    return (
+        f"*{_MSG['processing']}*\n\n"
+        f"```\n"
+        f"{'⬜' * filled}{'⬛' * (10 - filled)} {percent}%\n"
+        f"```\n\n"
+        f"_Harap tunggu, proses ini membutuhkan waktu..._"
+    )
+
+# User yang sedang punya proses generate berjalan
+_GENERATING = set()
+
 async def ghibli_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle command /ghibli untuk generate gambar"""
     user = update.effective_user
@@ -592,7 +1047,7 @@ async def ghibli_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         group_links = utils.get_allowed_groups_text()
         
         await message.reply_text(
-            f"*{CONFIG['messages']['not_in_group']}*\n\n"
+            f"*{_MSG['not_in_group']}*\n\n"
             f"Coba join dan gunakan di salah satu grup berikut:\n"
             f"{group_links}",
             parse_mode=ParseMode.MARKDOWN,
@@ -610,15 +1065,14 @@ async def ghibli_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     # Cek apakah user telah subscribe ke semua channel
-    subscribed, not_joined_channels = await check_user_subscriptions(context.bot, user.id)
+    subscribed, not_joined_channels = await cached_check_sub(context, user.id)
     if not subscribed:
         channel_links = utils.get_required_channels_text()
         
-        keyboard = [[InlineKeyboardButton("✅ Sudah Join Semua", callback_data="check_subscription")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_CHECK_SUB_ONLY
         
         await message.reply_text(
-            f"*{CONFIG['messages']['not_subscribed']}*\n\n"
+            f"*{_MSG['not_subscribed']}*\n\n"
             f"Join dulu channel berikut:\n"
             f"{channel_links}\n\n"
             f"Klik tombol di bawah setelah join semua channel.",
@@ -632,11 +1086,10 @@ async def ghibli_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_data = utils.get_user_data(user.id)
     
     if user_data["remaining_limit"] <= 0:
-        keyboard = [[InlineKeyboardButton("🔄 Cek Limit", callback_data="check_limit")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_CHECK_LIMIT_ONLY
         
         await message.reply_text(
-            f"*{CONFIG['messages']['limit_exceeded']}*\n\n"
+            f"*{_MSG['limit_exceeded']}*\n\n"
             f"Limit reset setiap jam 00:00 WIB.\n"
             f"Tunggu besok atau gunakan link referral untuk dapat bonus limit.",
             reply_markup=reply_markup,
@@ -644,140 +1097,180 @@ async def ghibli_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     
+    # Satu generate per user dalam satu waktu (update diproses bersamaan)
+    if user.id in _GENERATING:
+        await message.reply_text(
+            "⏳ *Foto lo sebelumnya masih diproses, tunggu bentar ya!*",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    _GENERATING.add(user.id)
+    try:
+        await generate_for_user(update, context, user_data)
+    finally:
+        _GENERATING.discard(user.id)
+
+async def generate_for_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_data: Dict) -> None:
+    """Download foto, generate gambar Ghibli dan kirim hasilnya ke user"""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    message = update.message
+    
     # Ambil foto yang dikirim user
     photo_file = await message.photo[-1].get_file()
     
-    # Buat folder temp jika belum ada
-    utils.ensure_directories()
-    
-    # Download foto
-    photo_path = f"{CONFIG['storage']['temp_folder']}/{user.id}_{int(time.time())}_input.jpg"
-    await photo_file.download_to_drive(photo_path)
+    # Download foto langsung ke memory (tanpa round-trip ke disk)
+    photo_buffer = io.BytesIO()
+    await photo_file.download_to_memory(photo_buffer)
+    photo_buffer.seek(0)
     
     # Kirim pesan proses
     process_message = await message.reply_text(
-        f"*{CONFIG['messages']['processing']}*\n\n"
-        "```\n"
-        "⬛⬛⬛⬛⬛⬛⬛⬛⬛⬛ 0%\n"
-        "```\n\n"
-        "_Harap tunggu, proses ini membutuhkan waktu..._",
+        progress_text(0),
         parse_mode=ParseMode.MARKDOWN
     )
     
-    # Update pesan proses untuk simulasi progress
-    progress_steps = 10
-    for i in range(1, progress_steps + 1):
-        filled = "⬜" * i
-        empty = "⬛" * (progress_steps - i)
-        
-        try:
-            await process_message.edit_text(
-                f"*{CONFIG['messages']['processing']}*\n\n"
-                f"```\n"
-                f"{filled}{empty} {i*10}%\n"
-                f"```\n\n"
-                f"_Harap tunggu, proses ini membutuhkan waktu..._",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logger.error(f"Error updating progress: {e}")
-        
-        await asyncio.sleep(0.5)
+    # Update progress dijadwalkan dari thread inference tanpa di-await, jadi dikunci supaya
+    # tidak ada yang mendarat setelah pesan proses dihapus atau diganti pesan error
+    progress_lock = asyncio.Lock()
+    progress_done = False
+    
+    async def report_progress(percent: int) -> None:
+        async with progress_lock:
+            if progress_done:
+                return
+            try:
+                await process_message.edit_text(
+                    progress_text(percent),
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            except Exception as e:
+                logger.error(f"Error updating progress: {e}")
+    
+    async def finish_progress() -> None:
+        nonlocal progress_done
+        async with progress_lock:
+            progress_done = True
     
     # Tandai bot sedang mengetik
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_PHOTO)
     
     try:
         # Load image
-        input_image = Image.open(photo_path)
+        input_image = Image.open(photo_buffer)
         
         # Generate image dengan strength dari preferensi user atau default
-        strength = user_data["preferences"].get("strength", CONFIG["features"]["default_strength"])
+        strength = user_data["preferences"].get("strength", _DEFAULT_STRENGTH)
         
         # Generate image
         start_time = time.time()
-        result_image, process_time = await generate_ghibli_image(input_image, strength)
+        result_image, process_time = await generate_ghibli_image(input_image, strength, report_progress)
+        await finish_progress()
         
-        # Simpan hasil
-        result_path = f"{CONFIG['storage']['temp_folder']}/{user.id}_{int(time.time())}_output.jpg"
-        result_image.save(result_path)
+        # Encode hasil ke memory di thread supaya event loop tidak ter-block
+        result_buffer = await asyncio.to_thread(encode_jpeg, result_image)
         
         # Update limit dan statistik user
         user_data["remaining_limit"] -= 1
         user_data["total_generations"] += 1
-        user_data["last_generation_time"] = datetime.now().isoformat()
-        utils.update_user_data(user.id, user_data)
-        utils.update_user_stats(user.id, user_data)
+        user_data["last_generation_time"] = int(time.time())
+        utils.update_user_and_stats(user.id, user_data)
         
         # Kirim gambar hasil
-        with open(result_path, 'rb') as photo:
-            # Prepare caption
-            caption = (
-                f"*{CONFIG['messages']['success']}*\n\n"
-                f"👤 *Dibuat oleh:* [{user.first_name}](tg://user?id={user.id})\n"
-                f"⏱ *Waktu proses:* `{process_time:.2f}` detik\n"
-                f"🔄 *Limit tersisa:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}`\n\n"
-                f"_Powered by GhibliBotTelegram_ 🤖"
-            )
-            
-            # Prepare keyboard
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Bikin Lagi", callback_data="start_generate"),
-                    InlineKeyboardButton("🔗 Share Referral", callback_data="referral")
-                ],
-                [InlineKeyboardButton("🏠 Menu Utama", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=message.message_id
-            )
+        # Prepare caption
+        caption = (
+            f"*{_MSG['success']}*\n\n"
+            f"👤 *Dibuat oleh:* [{user.first_name}](tg://user?id={user.id})\n"
+            f"⏱ *Waktu proses:* `{process_time:.2f}` detik\n"
+            f"🔄 *Limit tersisa:* `{user_data['remaining_limit']}/{_DAILY_LIMIT}`\n\n"
+            f"_Powered by GhibliBotTelegram_ 🤖"
+        )
+        
+        # Prepare keyboard
+        reply_markup = _KB_RESULT
+        
+        await context.bot.send_photo(
+            chat_id=chat_id,
+            photo=result_buffer,
+            caption=caption,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_to_message_id=message.message_id
+        )
         
         # Delete process message
         await process_message.delete()
         
-        # Simpan hasil secara permanen jika diaktifkan dalam konfigurasi
+        # Simpan hasil secara permanen jika diaktifkan (pakai JPEG yang sudah di-encode)
         if CONFIG["storage"]["keep_results"]:
-            result_perm_path = f"{CONFIG['storage']['result_folder']}/{user.id}_{int(time.time())}_output.jpg"
-            result_image.save(result_perm_path)
-        else:
-            # Hapus file temporary
-            try:
-                os.remove(photo_path)
-                os.remove(result_path)
-            except Exception as e:
-                logger.error(f"Error removing temp files: {e}")
+            result_perm_path = _RESULT_FOLDER / f"{user.id}_{int(time.time())}_output.jpg"
+            result_perm_path.write_bytes(result_buffer.getvalue())
         
     except Exception as e:
         logger.error(f"Error generating image: {e}")
         
+        await finish_progress()
         await process_message.edit_text(
-            f"*{CONFIG['messages']['error']}*\n\n"
+            f"*{_MSG['error']}*\n\n"
             f"Detail error: `{str(e)}`\n\n"
             f"Silakan coba lagi dengan foto lain.",
             parse_mode=ParseMode.MARKDOWN
         )
-        
-        # Hapus file temporary
-        try:
-            os.remove(photo_path)
-        except:
-            pass
 
 # ============== CALLBACK HANDLERS ==============
 
+# Isi terakhir tiap pesan di chat_data["last_edit"]: message_id -> (hash teks, id keyboard)
+# Disimpan per chat supaya edit dari user mana pun di grup ikut tercatat
+_MAX_TRACKED_EDITS = 256
+
+async def safe_edit(query, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None, **kwargs) -> None:
+    """Edit pesan callback, lewati request jika isi dan keyboard sama dengan isi pesan saat ini"""
+    last_edit = context.chat_data.setdefault("last_edit", {})
+    message_id = query.message.message_id
+    
+    # Keyboard statis berupa singleton, jadi cukup dibandingkan lewat id()
+    edit_key = (hash(text), id(reply_markup))
+    if last_edit.get(message_id) == edit_key:
+        return
+    
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, **kwargs)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    
+    last_edit.pop(message_id, None)
+    last_edit[message_id] = edit_key
+    if len(last_edit) > _MAX_TRACKED_EDITS:
+        del last_edit[next(iter(last_edit))]
+
+# Waktu terakhir tombol ditekan di bot_data["last_press"]: (user_id, callback_data) -> waktu, untuk debounce
+_PRESS_DEBOUNCE = 0.3
+
+async def trim_last_press(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job berkala untuk membuang entry debounce yang sudah kedaluwarsa"""
+    last_press = context.bot_data.setdefault("last_press", {})
+    cutoff = time.time() - _PRESS_DEBOUNCE
+    for key in [k for k, ts in last_press.items() if ts < cutoff]:
+        del last_press[key]
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle callback dari inline buttons"""
     query = update.callback_query
     user = query.from_user
     data = query.data
     
+    # Abaikan tekan tombol yang sama berulang kali dalam waktu singkat
+    last_press = context.bot_data.setdefault("last_press", {})
+    key = (user.id, data)
+    now = time.time()
+    prev = last_press.get(key, 0.0)
+    last_press[key] = now
+    if now - prev < _PRESS_DEBOUNCE:
+        await query.answer("⏳")
+        return
+    
     # Acknowledge the button click
     await query.answer()
     
@@ -798,12 +1291,16 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             required_permission = "all"  # Only owner can change roles
         
         if not utils.has_permission(user.id, required_permission):
-            await query.edit_message_text(
+            await safe_edit(
+                query, context,
                 "❌ *Lo gak punya permission buat melakukan aksi ini, bro!*",
                 parse_mode=ParseMode.MARKDOWN
             )
             return
         
+        # Aksi admin mengubah data user, tampilkan leaderboard terbaru setelahnya
+        invalidate_top_cache(context)
+        
         # Process admin actions
         if action == "add_limit" and len(parts) >= 4:
             target_id = parts[2]
@@ -811,7 +1308,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             success, new_limit = utils.modify_user_limit(int(target_id), amount)
             
             if success:
-                await query.edit_message_text(
+                await safe_edit(
+                    query, context,
                     f"✅ *Limit berhasil ditambahkan!*\n\n"
                     f"👤 *User ID:* `{target_id}`\n"
                     f"➕ *Ditambahkan:* `{amount}`\n"
@@ -819,9 +1317,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     f"_Kembali ke menu dalam 3 detik..._",
                     parse_mode=ParseMode.MARKDOWN
                 )
-                # Sleep dan redirect ke menu
-                await asyncio.sleep(3)
-                await back_to_menu(update, context)
+                # Redirect ke menu setelah 3 detik lewat JobQueue, handler langsung selesai
+                schedule_back_to_menu(context, query)
             
         elif action == "reduce_limit" and len(parts) >= 4:
             target_id = parts[2]
@@ -829,7 +1326,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             success, new_limit = utils.modify_user_limit(int(target_id), -amount)
             
             if success:
-                await query.edit_message_text(
+                await safe_edit(
+                    query, context,
                     f"✅ *Limit berhasil dikurangi!*\n\n"
                     f"👤 *User ID:* `{target_id}`\n"
                     f"➖ *Dikurangi:* `{amount}`\n"
@@ -837,30 +1335,27 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     f"_Kembali ke menu dalam 3 detik..._",
                     parse_mode=ParseMode.MARKDOWN
                 )
-                # Sleep dan redirect ke menu
-                await asyncio.sleep(3)
-                await back_to_menu(update, context)
+                # Redirect ke menu setelah 3 detik lewat JobQueue, handler langsung selesai
+                schedule_back_to_menu(context, query)
         
         elif action == "role" and len(parts) >= 4:
             target_id = parts[2]
             new_role = parts[3]
             
             # Update role user di database
-            user_data = utils.get_user_data(int(target_id))
-            user_data["role"] = new_role
-            success = utils.update_user_data(int(target_id), user_data)
+            with utils.mutate_user(int(target_id)) as user_data:
+                user_data["role"] = new_role
             
-            if success:
-                await query.edit_message_text(
-                    f"✅ *Role user berhasil diubah!*\n\n"
-                    f"👤 *User ID:* `{target_id}`\n"
-                    f"👑 *Role baru:* `{new_role}`\n\n"
-                    f"_Kembali ke menu dalam 3 detik..._",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-                # Sleep dan redirect ke menu
-                await asyncio.sleep(3)
-                await back_to_menu(update, context)
+            await safe_edit(
+                query, context,
+                f"✅ *Role user berhasil diubah!*\n\n"
+                f"👤 *User ID:* `{target_id}`\n"
+                f"👑 *Role baru:* `{new_role}`\n\n"
+                f"_Kembali ke menu dalam 3 detik..._",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            # Redirect ke menu setelah 3 detik lewat JobQueue, handler langsung selesai
+            schedule_back_to_menu(context, query)
         
         return
     
@@ -892,43 +1387,58 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif data == "referral":
         await referral_callback(update, context)
 
+async def register_user_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job untuk mendaftarkan user baru ke database"""
+    utils.get_user_data(context.job.user_id)
+
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle callback untuk kembali ke menu utama"""
     query = update.callback_query
     user = query.from_user
     
-    # Update data user
-    user_data = utils.get_user_data(user.id)
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📸 Mulai Generate", callback_data="start_generate"),
-            InlineKeyboardButton("ℹ️ Tutorial", callback_data="tutorial")
-        ],
-        [
-            InlineKeyboardButton("🏆 Top Users", callback_data="top_users"),
-            InlineKeyboardButton("📊 Statistik", callback_data="stats")
-        ],
-        [
-            InlineKeyboardButton("🔗 Referral", callback_data="referral"),
-            InlineKeyboardButton("🤖 About Bot", callback_data="about")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_MAIN_MENU
     
-    welcome_message = (
-        f"*{CONFIG['messages']['welcome']}*\n\n"
-        f"*Limit harian lo:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}` foto\n"
-        f"*Terakhir generate:* {utils.format_time_ago(user_data.get('last_generation_time', None))}\n\n"
-        f"```\n🔥 Pilih menu di bawah untuk mulai pakai fitur bot 🔥\n```"
-    )
+    user_data = utils.find_user(user.id)
+    if user_data is None:
+        # User belum terdaftar: tampilkan menu tanpa limit, daftarkan di luar handler
+        welcome_message = _WELCOME_NO_LIMIT_TMPL.format(welcome=welcome_greeting(user.first_name))
+        context.job_queue.run_once(register_user_job, 0, user_id=user.id)
+    else:
+        # Update data user
+        user_data = utils.get_user_data(user.id)
+        welcome_message = welcome_text(user.first_name, user_data)
     
-    await query.edit_message_text(
+    await safe_edit(
+        query, context,
         welcome_message,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
     )
 
+def schedule_back_to_menu(context: ContextTypes.DEFAULT_TYPE, query) -> None:
+    """Jadwalkan pesan callback kembali ke menu utama setelah 3 detik"""
+    context.job_queue.run_once(
+        back_to_menu_from_job,
+        when=3,
+        chat_id=query.message.chat_id,
+        user_id=query.from_user.id,
+        data={"message_id": query.message.message_id, "first_name": query.from_user.first_name}
+    )
+
+async def back_to_menu_from_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job untuk mengedit pesan kembali ke menu utama"""
+    job = context.job
+    user_data = utils.get_user_data(job.user_id)
+    context.chat_data.setdefault("last_edit", {}).pop(job.data["message_id"], None)
+    
+    await context.bot.edit_message_text(
+        welcome_text(job.data["first_name"], user_data),
+        chat_id=job.chat_id,
+        message_id=job.data["message_id"],
+        reply_markup=_KB_MAIN_MENU,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
 async def start_generate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle callback untuk mulai generate"""
     query = update.callback_query
@@ -939,11 +1449,11 @@ async def start_generate_callback(update: Update, context: ContextTypes.DEFAULT_
     if not utils.is_in_allowed_group(chat_id) and chat_id > 0:  # chat_id > 0 berarti private chat
         group_links = utils.get_allowed_groups_text()
         
-        keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_BACK_ONLY
         
-        await query.edit_message_text(
-            f"*{CONFIG['messages']['not_in_group']}*\n\n"
+        await safe_edit(
+            query, context,
+            f"*{_MSG['not_in_group']}*\n\n"
             f"Coba join dan gunakan di salah satu grup berikut:\n"
             f"{group_links}",
             reply_markup=reply_markup,
@@ -953,18 +1463,15 @@ async def start_generate_callback(update: Update, context: ContextTypes.DEFAULT_
         return
     
     # Cek apakah user telah subscribe ke semua channel
-    subscribed, not_joined_channels = await check_user_subscriptions(context.bot, user.id)
+    subscribed, not_joined_channels = await cached_check_sub(context, user.id)
     if not subscribed:
         channel_links = utils.get_required_channels_text()
         
-        keyboard = [
-            [InlineKeyboardButton("✅ Sudah Join Semua", callback_data="check_subscription")],
-            [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_CHECK_SUB
         
-        await query.edit_message_text(
-            f"*{CONFIG['messages']['not_subscribed']}*\n\n"
+        await safe_edit(
+            query, context,
+            f"*{_MSG['not_subscribed']}*\n\n"
             f"Join dulu channel berikut:\n"
             f"{channel_links}\n\n"
             f"Klik tombol di bawah setelah join semua channel.",
@@ -978,17 +1485,11 @@ async def start_generate_callback(update: Update, context: ContextTypes.DEFAULT_
     user_data = utils.get_user_data(user.id)
     
     if user_data["remaining_limit"] <= 0:
-        keyboard = [
-            [
-                InlineKeyboardButton("🔄 Cek Limit", callback_data="check_limit"),
-                InlineKeyboardButton("🔗 Referral", callback_data="referral")
-            ],
-            [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_LIMIT_EXCEEDED
         
-        await query.edit_message_text(
-            f"*{CONFIG['messages']['limit_exceeded']}*\n\n"
+        await safe_edit(
+            query, context,
+            f"*{_MSG['limit_exceeded']}*\n\n"
             f"Limit reset setiap jam 00:00 WIB.\n"
             f"Undang teman dengan link referral untuk mendapat bonus limit tambahan!",
             reply_markup=reply_markup,
@@ -997,19 +1498,12 @@ async def start_generate_callback(update: Update, context: ContextTypes.DEFAULT_
         return
     
     # Instruksi generate
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
-    instructions = (
-        f"*📸 Cara Generate Foto Ghibli 📸*\n\n"
-        f"1️⃣ Kirim foto di *grup yang diizinkan*\n"
-        f"2️⃣ Tambahkan caption `/ghibli`\n"
-        f"3️⃣ Tunggu sampai proses selesai\n\n"
-        f"*Limit tersisa:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}` foto\n\n"
-        f"_Catatan: Foto lo bakal diubah ke style Studio Ghibli yang keren abis!_ ✨"
-    )
+    instructions = _INSTRUCTIONS_TMPL.format(remaining=user_data['remaining_limit'])
     
-    await query.edit_message_text(
+    await safe_edit(
+        query, context,
         instructions,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
@@ -1019,101 +1513,32 @@ async def tutorial_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Handle callback untuk menampilkan tutorial"""
     query = update.callback_query
     
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
-    channel_links = utils.get_required_channels_text()
-    
-    tutorial = (
-        f"*📚 TUTORIAL GHIBLIBOT 📚*\n\n"
-        f"*Cara Pakai Bot:*\n"
-        f"1️⃣ Join ketiga channel yang diperlukan:\n"
-        f"{channel_links}\n\n"
-        f"2️⃣ Pastikan lo ada di grup yang diizinkan\n\n"
-        f"3️⃣ Kirim foto dengan caption `/ghibli`\n\n"
-        f"4️⃣ Tunggu proses selesai (biasanya 10-30 detik)\n\n"
-        f"5️⃣ Tadaaa! Foto lo udah berubah jadi style Ghibli!\n\n"
-        f"_Note: Lo punya limit {CONFIG['features']['daily_limit']} foto per hari. Limit reset jam 00:00 WIB._\n\n"
-        
-        f"*🔗 SISTEM REFERRAL 🔗*\n"
-        f"- Klik menu 'Referral' untuk mendapatkan link referral kamu\n"
-        f"- Share link ke teman untuk mendapatkan bonus limit:\n"
-        f"  • Teman dapat bonus +{CONFIG['referral']['referee_bonus']} limit\n"
-        f"  • Kamu dapat bonus +{CONFIG['referral']['referrer_bonus']} limit\n"
-        f"  • Jika {CONFIG['referral']['min_uses_for_extra_bonus']}+ orang pakai link kamu, dapat bonus tambahan +{CONFIG['referral']['extra_bonus']} limit\n\n"
-        
-        f"*💡 Tips:*\n"
-        f"- Hasil terbaik untuk foto dengan pencahayaan bagus\n"
-        f"- Hindari foto yang terlalu gelap atau blur\n"
-        f"- Foto wajah close-up biasanya memberikan hasil terbaik!"
-    )
-    
-    await query.edit_message_text(
-        tutorial,
+    await safe_edit(
+        query, context,
+        _TUTORIAL_TEXT,
         reply_markup=reply_markup,
-        parse_mode=ParseMode.MARKDOWN,
+        parse_mode=ParseMode.HTML,
         disable_web_page_preview=True
     )
 
-async def top_users_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle callback untuk menampilkan top users"""
-    query = update.callback_query
-    db = utils.load_database()
-    
-    # Buat keyboard untuk tombol navigasi
-    keyboard = [
-        [
-            InlineKeyboardButton("👥 Top Users", callback_data="top_users"),
-            InlineKeyboardButton("🔗 Top Referrers", callback_data="top_referrers")
-        ],
-        [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    top_users_text = "*🏆 TOP 10 USERS 🏆*\n\n"
-    
-    if not db["stats"]["top_users"]:
-        top_users_text += "_Belum ada data pengguna._\n"
-    else:
-        for i, user_stat in enumerate(db["stats"]["top_users"], 1):
-            name = user_stat["first_name"] or user_stat["username"] or f"User {user_stat['user_id']}"
-            top_users_text += f"{i}. {name}: `{user_stat['total_generations']}` generate\n"
-    
-    await query.edit_message_text(
-        top_users_text,
-        reply_markup=reply_markup,
+async def render_top(query, context: ContextTypes.DEFAULT_TYPE, kind: str) -> None:
+    """Tampilkan leaderboard ("users" atau "referrers") dari cache teks"""
+    await safe_edit(
+        query, context,
+        cached_top_text(context, kind),
+        reply_markup=_KB_TOP_NAV,
         parse_mode=ParseMode.MARKDOWN
     )
 
+async def top_users_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle callback untuk menampilkan top users"""
+    await render_top(update.callback_query, context, "users")
+
 async def top_referrers_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle callback untuk menampilkan top referrers"""
-    query = update.callback_query
-    db = utils.load_database()
-    
-    # Buat keyboard untuk tombol navigasi
-    keyboard = [
-        [
-            InlineKeyboardButton("👥 Top Users", callback_data="top_users"),
-            InlineKeyboardButton("🔗 Top Referrers", callback_data="top_referrers")
-        ],
-        [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    top_referrers_text = "*🔗 TOP 10 REFERRERS 🔗*\n\n"
-    
-    if "top_referrers" not in db["stats"] or not db["stats"]["top_referrers"]:
-        top_referrers_text += "_Belum ada data referral._\n"
-    else:
-        for i, user_stat in enumerate(db["stats"]["top_referrers"], 1):
-            name = user_stat["first_name"] or user_stat["username"] or f"User {user_stat['user_id']}"
-            top_referrers_text += f"{i}. {name}: `{user_stat['total_referrals']}` referrals\n"
-    
-    await query.edit_message_text(
-        top_referrers_text,
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.MARKDOWN
-    )
+    await render_top(update.callback_query, context, "referrers")
 
 async def stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle callback untuk menampilkan statistik"""
@@ -1131,15 +1556,15 @@ async def stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         f"👥 *Total users:* `{total_users}`\n"
         f"🖼 *Total generate:* `{total_generations}`\n"
         f"🔗 *Total referrals:* `{total_referrals}`\n"
-        f"🔄 *Limit tersisa:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}`\n"
+        f"🔄 *Limit tersisa:* `{user_data['remaining_limit']}/{_DAILY_LIMIT}`\n"
         f"🕒 *Terakhir generate:* {utils.format_time_ago(user_data.get('last_generation_time', None))}\n\n"
         
         f"*⚡️ INFO BOT ⚡️*\n"
         f"🚀 Status: `Online`\n"
         f"💻 Server: `{'GPU' if torch.cuda.is_available() else 'CPU'} Optimized`\n"
-        f"🧠 Model: `{CONFIG['model']['model_id'].split('/')[-1]}`\n"
-        f"📊 Version: `{CONFIG['bot']['version']}`\n"
-        f"📅 Last Update: `{CONFIG['bot']['release_date']}`\n\n"
+        f"🧠 Model: `{_MODEL_NAME}`\n"
+        f"📊 Version: `{_BOT_VERSION}`\n"
+        f"📅 Last Update: `{_RELEASE_DATE}`\n\n"
         
         f"*📊 USER STATS 📊*\n"
         f"🖼 *Total generate:* `{user_data['total_generations']}`\n"
@@ -1149,10 +1574,10 @@ async def stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         f"_Bot ini menggunakan model Stable Diffusion yang dioptimalkan untuk style Studio Ghibli._"
     )
     
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
-    await query.edit_message_text(
+    await safe_edit(
+        query, context,
         stats_text,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
@@ -1162,40 +1587,13 @@ async def about_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Handle callback untuk menampilkan info about bot"""
     query = update.callback_query
     
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    channel_links = utils.get_required_channels_text()
+    reply_markup = _KB_BACK_ONLY
     
-    about_text = (
-        f"*🤖 TENTANG GHIBLIBOT 🤖*\n\n"
-        f"{CONFIG['bot']['name']} adalah bot keren yang mengubah foto biasa menjadi karya seni bergaya Studio Ghibli. Bot ini menggunakan teknologi AI canggih untuk menghasilkan transformasi foto yang memukau.\n\n"
-        
-        f"*🌟 FITUR 🌟*\n"
-        f"• Transformasi foto ke style Ghibli\n"
-        f"• Proses super cepat dengan GPU\n"
-        f"• Interface yang user-friendly\n"
-        f"• Sistem referral untuk bonus limit\n"
-        f"• Statistik penggunaan\n"
-        f"• Sistem limit harian\n\n"
-        
-        f"*👨‍💻 DEVELOPER 👨‍💻*\n"
-        f"Bot ini dibuat oleh @{CONFIG['bot']['username']}\n\n"
-        
-        f"*📢 CHANNEL & GRUP 📢*\n"
-        f"{channel_links}\n\n"
-        
-        f"*📝 VERSI BOT 📝*\n"
-        f"Version: `{CONFIG['bot']['version']}`\n"
-        f"Last Update: `{CONFIG['bot']['release_date']}`\n\n"
-        
-        f"_Thanks for using {CONFIG['bot']['name']}!_ ❤️"
-    )
-    
-    await query.edit_message_text(
-        about_text,
+    await safe_edit(
+        query, context,
+        _ABOUT_TEXT,
         reply_markup=reply_markup,
-        parse_mode=ParseMode.MARKDOWN,
+        parse_mode=ParseMode.HTML,
         disable_web_page_preview=True
     )
 
@@ -1204,19 +1602,17 @@ async def check_subscription_callback(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     user = query.from_user
     
-    # Cek subscription lagi
-    subscribed, not_joined_channels = await check_user_subscriptions(context.bot, user.id)
+    # Cek subscription lagi (buang cache supaya benar-benar dicek ulang)
+    context.bot_data.setdefault("sub_cache", {}).pop(user.id, None)
+    subscribed, not_joined_channels = await cached_check_sub(context, user.id)
     
     if not subscribed:
         channel_links = utils.get_required_channels_text()
         
-        keyboard = [
-            [InlineKeyboardButton("✅ Sudah Join Semua", callback_data="check_subscription")],
-            [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_CHECK_SUB
         
-        await query.edit_message_text(
+        await safe_edit(
+            query, context,
             f"*❌ Lo masih belum join semua channel!*\n\n"
             f"Join dulu channel berikut:\n"
             f"{channel_links}\n\n"
@@ -1226,10 +1622,10 @@ async def check_subscription_callback(update: Update, context: ContextTypes.DEFA
             disable_web_page_preview=True
         )
     else:
-        keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _KB_BACK_ONLY
         
-        await query.edit_message_text(
+        await safe_edit(
+            query, context,
             f"*✅ Keren! Lo udah join semua channel!*\n\n"
             f"Sekarang lo bisa pakai bot ini dengan mengirim foto dengan caption `/ghibli` di grup yang diizinkan.",
             reply_markup=reply_markup,
@@ -1242,22 +1638,19 @@ async def check_limit_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     user = query.from_user
     user_data = utils.get_user_data(user.id)
     
-    keyboard = [
-        [InlineKeyboardButton("🔗 Dapatkan Link Referral", callback_data="referral")],
-        [InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_REFERRAL_BACK
     
     limit_text = (
         f"*📊 INFO LIMIT KAMU 📊*\n\n"
         f"👤 *User:* {user.first_name}\n"
-        f"🎯 *Limit tersisa:* `{user_data['remaining_limit']}/{CONFIG['features']['daily_limit']}` per hari\n"
+        f"🎯 *Limit tersisa:* `{user_data['remaining_limit']}/{_DAILY_LIMIT}` per hari\n"
         f"🕒 *Reset limit:* Setiap jam 00:00 WIB\n"
         f"🔄 *Terakhir generate:* {utils.format_time_ago(user_data.get('last_generation_time', None))}\n\n"
         f"_Tips: Undang temen dengan link referral untuk nambah limit!_ 🔗"
     )
     
-    await query.edit_message_text(
+    await safe_edit(
+        query, context,
         limit_text,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
@@ -1272,20 +1665,20 @@ async def referral_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     referral_link = utils.create_referral_link(user.id)
     user_data = utils.get_user_data(user.id)
     
-    keyboard = [[InlineKeyboardButton("🏠 Kembali ke Menu", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _KB_BACK_ONLY
     
     referral_text = (
         f"*🔗 LINK REFERRAL KAMU 🔗*\n\n"
-        f"{CONFIG['messages']['referral_info'].format(referral_link=referral_link)}\n\n"
+        f"{render('referral_info', referral_link=referral_link)}\n\n"
         f"*Statistik Referral Kamu:*\n"
         f"👥 *Orang yang diundang:* `{len(user_data['referral']['referred_users'])}`\n"
-        f"🎁 *Total bonus:* `{user_data['referral']['total_referrals'] * CONFIG['referral']['referrer_bonus']}`\n"
-        f"🔥 *Bonus spesial:* `{'Sudah diklaim' if user_data['referral']['bonus_claimed'] else f'Belum (butuh {CONFIG['referral']['min_uses_for_extra_bonus']} undangan)'}`\n\n"
+        f"🎁 *Total bonus:* `{user_data['referral']['total_referrals'] * _REFERRER_BONUS}`\n"
+        f"🔥 *Bonus spesial:* `{'Sudah diklaim' if user_data['referral']['bonus_claimed'] else f'Belum (butuh {_MIN_USES} undangan)'}`\n\n"
         f"_Share link ini ke teman-temanmu untuk dapatkan bonus limit!_ 🚀"
     )
     
-    await query.edit_message_text(
+    await safe_edit(
+        query, context,
         referral_text,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
@@ -1295,27 +1688,52 @@ async def referral_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle errors dalam bot"""
-    logger.error(f"Exception while handling an update: {context.error}")
+    logger.error("Exception while handling an update: %s", context.error, exc_info=context.error)
     
-    # Log error secara detail
+    # Log error secara detail (isi update cuma dirender jika level DEBUG aktif)
     if update:
-        logger.error(f"Update: {update}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Update: %r", update)
         if update.effective_message:
             text = f"❌ *Error!* Terjadi kesalahan saat memproses permintaan Anda. Coba lagi nanti."
             await update.effective_message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
 # ============== MAIN FUNCTION ==============
 
+async def post_init(application: Application) -> None:
+    """Jalankan background task setelah aplikasi diinisialisasi"""
+    application.create_task(inference_loop())
+    application.job_queue.run_repeating(trim_last_press, interval=60, first=60)
+    application.job_queue.run_repeating(trim_sub_cache, interval=_SUB_CACHE_TTL, first=_SUB_CACHE_TTL)
+
 def main() -> None:
     """Fungsi utama untuk menjalankan bot"""
+    global model
+    
     # Pastikan semua direktori yang dibutuhkan sudah ada
     utils.ensure_directories()
     
     # Bersihkan file temporary lama
     utils.clean_temp_files()
     
+    # Muat database ke memory sekali di awal
+    utils.load_database()
+    
+    # Load model di awal kalau perlu compile, supaya user pertama tidak menunggu
+    if CONFIG["model"]["compile_unet"]:
+        model = model_executor.submit(load_model).result()
+        model_executor.submit(warm_up_model).result()
+    
     # Buat aplikasi bot dengan token dari konfigurasi
-    application = Application.builder().token(CONFIG["bot"]["token"]).build()
+    # Update diproses bersamaan supaya user yang berbeda tidak saling menunggu
+    application = (
+        Application.builder()
+        .token(CONFIG["bot"]["token"])
+        .concurrent_updates(256)
+        .persistence(PicklePersistence(filepath=CONFIG["storage"]["state_file"]))
+        .post_init(post_init)
+        .build()
+    )
     
     # Tambahkan handlers untuk commands
     application.add_handler(CommandHandler("start", start_command))
@@ -1332,14 +1750,14 @@ def main() -> None:
     application.add_handler(CommandHandler("userstats", user_stats_command))
     
     # Tambahkan handler untuk callback query
-    application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(CallbackQueryHandler(button_callback, block=False))
     
     # Tambahkan error handler
     application.add_error_handler(error_handler)
     
     # Start the Bot
     application.run_polling()
-    logger.info(f"{CONFIG['bot']['name']} started!")
+    logger.info(f"{_BOT_NAME} started!")
 
 if __name__ == "__main__":
     main()
@@ -4,23 +4,47 @@ Modul Utilitas dan Pengelolaan Database
 Berisi fungsi-fungsi untuk mengelola database dan utilitas lainnya
 """
 
+import asyncio
+import atexit
+import bisect
 import json
 import os
+import shutil
+import sqlite3
+import threading
 import time
 import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import hashlib
 import base64
-from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Union, Optional, Any
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Any
 
-from config import CONFIG
+from config import CONFIG, ALLOWED_GROUP_IDS, PERMISSIONS_BY_ROLE, ROLE_BY_USER, build_referral_link
 
-# Setup logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    filename=os.path.join(CONFIG["storage"]["logs_folder"], "bot.log") if os.path.exists(CONFIG["storage"]["logs_folder"]) else None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Setup logging: handler hanya menaruh record ke queue, penulisan file/stream dilakukan thread listener
+_log_target = (
+    logging.FileHandler(os.path.join(CONFIG["storage"]["logs_folder"], "bot.log"))
+    if os.path.exists(CONFIG["storage"]["logs_folder"]) else logging.StreamHandler()
 )
+_log_target.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.handlers.QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))  # Format lengkap dilakukan di _log_target
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_target)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
 logger = logging.getLogger(__name__)
 
 # ============== FILE & FOLDER MANAGEMENT ==============
@@ -48,18 +72,22 @@ def clean_temp_files(max_age: int = 24) -> None:
     current_time = time.time()
     deleted_count = 0
     
-    for filename in os.listdir(temp_folder):
-        file_path = os.path.join(temp_folder, filename)
-        # Cek jika file (bukan folder) dan lebih tua dari max_age jam
-        if os.path.isfile(file_path) and current_time - os.path.getmtime(file_path) > max_age * 3600:
-            os.remove(file_path)
-            deleted_count += 1
+    # scandir mengembalikan tipe dan stat entry dari listing direktori, tanpa stat terpisah per file
+    with os.scandir(temp_folder) as entries:
+        for entry in entries:
+            # Cek jika file (bukan folder) dan lebih tua dari max_age jam
+            if entry.is_file(follow_symlinks=False) and current_time - entry.stat(follow_symlinks=False).st_mtime > max_age * 3600:
+                os.unlink(entry.path)
+                deleted_count += 1
     
     if deleted_count > 0:
         logger.info(f"Cleaned {deleted_count} temporary files older than {max_age} hours")
 
 def backup_database() -> bool:
     """Membuat backup database"""
+    if _USE_SQLITE:
+        return _sqlite_backup()
+    
     db_file = CONFIG["storage"]["db_file"]
     backup_folder = CONFIG["storage"]["backup_folder"]
     
@@ -74,8 +102,13 @@ def backup_database() -> bool:
     backup_file = os.path.join(backup_folder, f"backup_{timestamp}.json")
     
     try:
-        with open(db_file, 'r') as src, open(backup_file, 'w') as dst:
-            dst.write(src.read())
+        # Copy di level kernel (sendfile di Linux), lalu fsync supaya backup benar-benar di disk
+        shutil.copyfile(db_file, backup_file)
+        fd = os.open(backup_file, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
         logger.info(f"Database backup created: {backup_file}")
         return True
     except Exception as e:
@@ -84,6 +117,41 @@ def backup_database() -> bool:
 
 # ============== DATABASE MANAGEMENT ==============
 
+# Database di memory, dibaca sekali dari disk lalu di-flush secara debounce
+_DB_CACHE: Optional[Dict] = None
+_DB_DIRTY = False
+_FLUSH_DELAY = 0.5
+
+# Baris yang berubah sejak flush terakhir (dipakai storage SQLite untuk menulis per baris)
+_DIRTY_USERS = set()
+_DIRTY_LINKS = set()
+_DIRTY_ALL = True
+
+# Index kode referral -> user_id, supaya kode yang tidak valid ditolak tanpa menyentuh database
+_REF_CODE_INDEX: Dict[str, str] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+# Thread tunggal untuk I/O database, supaya urutan penulisan terjaga dan event loop tidak ter-block
+_IO_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ghibli-io")
+
+# Kunci penulisan ke disk: flush sinkron (atexit/script) bisa jalan bersamaan dengan thread I/O
+_DB_LOCK = threading.Lock()
+
+# Pakai orjson (C, langsung bytes) jika tersedia, fallback ke json bawaan
+_USE_ORJSON = orjson is not None and CONFIG["storage"]["serializer"] == "orjson"
+
+def _dumps(db: Dict) -> bytes:
+    """Serialize database ke bytes JSON (compact, tanpa indent)"""
+    if _USE_ORJSON:
+        return orjson.dumps(db)
+    return json.dumps(db, separators=(",", ":")).encode("utf-8")
+
+def _loads(data: bytes) -> Dict:
+    """Parse bytes JSON jadi database"""
+    if _USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def get_database_schema() -> Dict:
     """Mendapatkan struktur database default"""
     return {
@@ -102,8 +170,8 @@ def get_database_schema() -> Dict:
         "meta": {
             "version": CONFIG["bot"]["version"],
             "last_backup": None,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+            "created_at": _now_ts(),
+            "updated_at": _now_ts()
         }
     }
 
@@ -114,7 +182,7 @@ def get_user_schema() -> Dict:
         "username": "",
         "first_name": "",
         "last_name": "",
-        "join_date": datetime.now().isoformat(),
+        "join_date": _now_ts(),
         "status": "active",
         "role": "user",
         "remaining_limit": CONFIG["features"]["daily_limit"],
@@ -136,13 +204,28 @@ def get_user_schema() -> Dict:
     }
 
 def load_database() -> Dict:
-    """Memuat database dari file JSON"""
+    """Memuat database (dibaca dari file JSON sekali, selanjutnya dari memory)"""
+    global _DB_CACHE
+    
+    if _DB_CACHE is not None:
+        return _DB_CACHE
+    
+    if _USE_SQLITE:
+        db = _sqlite_load()
+        if db is not None:
+            _DB_CACHE = db
+            _index_referral_codes(db)
+            if _DIRTY_ALL:
+                save_database(db)
+            return db
+        # SQLite masih kosong, impor dari file JSON lama jika ada
+    
     db_file = CONFIG["storage"]["db_file"]
     
     if os.path.exists(db_file):
         try:
-            with open(db_file, 'r') as f:
-                db = json.load(f)
+            with open(db_file, 'rb') as f:
+                db = _loads(f.read())
             
             # Validasi dan update struktur jika diperlukan
             if "meta" not in db:
@@ -151,51 +234,168 @@ def load_database() -> Dict:
                 db["referrals"] = get_database_schema()["referrals"]
             
             # Update 'updated_at' metadata
-            db["meta"]["updated_at"] = datetime.now().isoformat()
+            _migrate_timestamps(db)
+            db["meta"]["updated_at"] = _now_ts()
             
+            _DB_CACHE = db
+            _index_referral_codes(db)
+            if _USE_SQLITE:
+                save_database(db)
+                logger.info(f"Imported {db_file} into {CONFIG['storage']['sqlite_file']}")
             return db
         except (json.JSONDecodeError, IOError) as e:
             logger.error(f"Error loading database: {str(e)}")
-            # Backup corrupt file jika ada
+            # Backup corrupt file jika ada (file asli tetap ada sampai database baru menggantikannya)
             if os.path.exists(db_file):
                 corrupt_backup = f"{db_file}.corrupt.{int(time.time())}"
-                os.rename(db_file, corrupt_backup)
+                try:
+                    os.link(db_file, corrupt_backup)
+                except OSError:
+                    # Hard link tidak didukung (mis. Windows tanpa privilege), copy saja
+                    shutil.copyfile(db_file, corrupt_backup)
                 logger.warning(f"Corrupt database backed up to {corrupt_backup}")
     
     # Jika file tidak ada atau terjadi error, buat database baru
     db = get_database_schema()
+    _DB_CACHE = db
+    _index_referral_codes(db)
     save_database(db)
     return db
 
-def save_database(db: Dict) -> bool:
-    """Menyimpan database ke file JSON"""
+def _index_referral_codes(db: Dict) -> None:
+    """Bangun ulang index kode referral dari database yang baru dimuat"""
+    _REF_CODE_INDEX.clear()
+    _REF_CODE_INDEX.update((code, info["user_id"]) for code, info in db["referrals"]["active_links"].items())
+
+def save_database(db: Dict, user_ids: Optional[Iterable] = None, links: Optional[Iterable] = None) -> bool:
+    """Tandai database berubah, penulisan ke disk dilakukan oleh flush yang di-debounce
+    
+    user_ids/links menandai baris user dan kode referral yang berubah; tanpa keduanya semua baris ditulis ulang.
+    """
+    global _DB_CACHE, _DIRTY_ALL
+    _DB_CACHE = db
+    
+    # File JSON selalu ditulis utuh, baris yang berubah hanya dicatat untuk SQLite
+    if _USE_SQLITE:
+        if user_ids is None and links is None:
+            _DIRTY_ALL = True
+        else:
+            _DIRTY_USERS.update(str(user_id) for user_id in user_ids or ())
+            _DIRTY_LINKS.update(links or ())
+    
+    mark_dirty()
+    return True
+
+def mark_dirty() -> None:
+    """Tandai database di memory berubah dan jadwalkan flush ke disk"""
+    global _DB_DIRTY, _flush_task
+    _DB_DIRTY = True
+    
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Tidak ada event loop (mis. dipanggil dari script), langsung tulis
+        flush_database()
+        return
+    
+    # Perubahan beruntun digabung jadi satu kali tulis
+    if _flush_task is None or _flush_task.done():
+        _flush_task = loop.create_task(_flush_soon())
+
+async def _flush_soon() -> None:
+    """Tunggu sebentar lalu tulis semua perubahan sekaligus lewat thread I/O"""
+    global _DB_DIRTY
+    loop = asyncio.get_running_loop()
+    
+    while _DB_DIRTY:
+        await asyncio.sleep(_FLUSH_DELAY)
+        
+        # Serialize di thread event loop (tidak ada mutasi bersamaan), tulis file di thread I/O
+        snapshot = _serialize_database()
+        if snapshot is None:
+            return
+        written, backed_up = await loop.run_in_executor(_IO_POOL, _write_database, *snapshot)
+        if not written:
+            _flush_failed()
+            return
+        if backed_up:
+            _backup_finished(snapshot[1])
+
+def flush_database() -> bool:
+    """Menulis database di memory ke file JSON jika ada perubahan (sinkron)"""
+    global _DB_DIRTY
+    
+    snapshot = _serialize_database()
+    if snapshot is None:
+        return True
+    written, backed_up = _write_database(*snapshot)
+    if not written:
+        _flush_failed()
+        return False
+    if backed_up:
+        _backup_finished(snapshot[1])
+        return flush_database()
+    return True
+
+def _flush_failed() -> None:
+    """Tandai ulang database setelah flush gagal, baris yang berubah tidak diketahui lagi jadi tulis semua"""
+    global _DB_DIRTY, _DIRTY_ALL
+    _DB_DIRTY = True
+    _DIRTY_ALL = True
+
+def _backup_finished(backup_time: float) -> None:
+    """Catat waktu backup yang berhasil, tersimpan ke disk di flush berikutnya"""
+    global _DB_DIRTY
+    _DB_CACHE["meta"]["last_backup"] = backup_time
+    _DB_DIRTY = True
+
+def _serialize_database() -> Optional[Tuple[Any, Optional[float]]]:
+    """Ambil snapshot database di memory beserta waktu backup jika sudah jatuh tempo, None jika tidak ada perubahan"""
+    global _DB_DIRTY
+    
+    if _DB_CACHE is None or not _DB_DIRTY:
+        return None
+    
+    _DB_DIRTY = False
+    now = _now_ts()
+    meta = _DB_CACHE["meta"]
+    
+    # last_backup baru dicatat setelah backup benar-benar berhasil (lihat _backup_finished)
+    meta["updated_at"] = now
+    backup = now if _backup_due(now) else None
+    
+    if _USE_SQLITE:
+        return _sqlite_rows(_DB_CACHE), backup
+    return _dumps(_DB_CACHE), backup
+
+def _write_database(data: Any, backup: Optional[float] = None) -> Tuple[bool, bool]:
+    """Tulis snapshot database ke disk secara atomic (aman dipanggil dari thread I/O), returns (written, backed_up)"""
+    with _DB_LOCK:
+        # Backup diambil dari file di disk sebelum ditimpa
+        backed_up = backup is not None and backup_database()
+        if _USE_SQLITE:
+            return _sqlite_write(data), backed_up
+        return _write_json(data), backed_up
+
+def _write_json(data: bytes) -> bool:
+    """Tulis bytes JSON ke file database lewat file temporary + rename"""
     db_file = CONFIG["storage"]["db_file"]
     temp_file = f"{db_file}.temp"
     
     try:
-        # Update metadata
-        db["meta"]["updated_at"] = datetime.now().isoformat()
-        
-        # Tulis ke file temporary dulu
-        with open(temp_file, 'w') as f:
-            json.dump(db, f, indent=2)
-        
-        # Ganti file asli dengan atomic operation
-        if os.path.exists(db_file):
-            os.replace(temp_file, db_file)
-        else:
-            os.rename(temp_file, db_file)
-        
-        # Buat backup otomatis jika diperlukan
-        if CONFIG["storage"]["auto_backup"]:
-            last_backup_str = db["meta"].get("last_backup")
-            if not last_backup_str or datetime.now() - datetime.fromisoformat(last_backup_str) > timedelta(hours=CONFIG["storage"]["backup_interval"]):
-                if backup_database():
-                    db["meta"]["last_backup"] = datetime.now().isoformat()
-                    # Simpan lagi dengan metadata backup yang diperbarui
-                    with open(db_file, 'w') as f:
-                        json.dump(db, f, indent=2)
+        # Tulis ke file temporary dulu langsung lewat fd, fsync sebelum rename supaya durable
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
         
+        # Ganti file asli dengan atomic operation (os.replace juga aman jika file asli belum ada)
+        os.replace(temp_file, db_file)
+
         return True
     except Exception as e:
         logger.error(f"Error saving database: {str(e)}")
@@ -203,8 +403,150 @@ def save_database(db: Dict) -> bool:
             os.remove(temp_file)
         return False
 
+def _backup_due(now: float) -> bool:
+    """Cek apakah sudah waktunya backup otomatis"""
+    if not CONFIG["storage"]["auto_backup"]:
+        return False
+    last_backup = _DB_CACHE["meta"].get("last_backup")
+    return not last_backup or now - last_backup > CONFIG["storage"]["backup_interval"] * 3600
+
+def _migrate_timestamps(db: Dict) -> bool:
+    """Konversi timestamp ISO string dari data lama ke epoch detik, returns True jika ada yang diubah"""
+    def convert(data: Dict, key: str) -> bool:
+        value = data.get(key)
+        if not isinstance(value, str):
+            return False
+        try:
+            data[key] = _parse_iso(value).timestamp()
+        except ValueError:
+            data[key] = None
+        return True
+    
+    changed = False
+    for key in ("created_at", "updated_at", "last_backup"):
+        changed |= convert(db["meta"], key)
+    for user_data in db["users"].values():
+        changed |= convert(user_data, "join_date")
+        changed |= convert(user_data, "last_generation_time")
+        if "referral" in user_data:
+            changed |= convert(user_data["referral"], "link_created_at")
+    for link in db["referrals"]["active_links"].values():
+        changed |= convert(link, "created_at")
+    return changed
+
+# Pastikan perubahan yang belum di-flush tetap tersimpan saat proses berhenti
+atexit.register(flush_database)
+
+# ============== SQLITE STORAGE ==============
+
+# Storage SQLite: satu baris per user dan per kode referral + tabel key-value untuk stats/referrals/meta
+_USE_SQLITE = CONFIG["storage"]["use_sqlite"]
+_sqlite_conn: Optional[sqlite3.Connection] = None
+
+def _sqlite() -> sqlite3.Connection:
+    """Buka koneksi SQLite sekali (dipakai bergantian saat load dan dari thread I/O)"""
+    global _sqlite_conn
+    
+    if _sqlite_conn is None:
+        storage = CONFIG["storage"]
+        conn = sqlite3.connect(storage["sqlite_file"], check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(storage['busy_timeout_ms'])}")
+        if storage["wal_mode"]:
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {storage['synchronous']}")
+        conn.execute(f"PRAGMA mmap_size = {int(storage['mmap_size'])}")
+        conn.execute("CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS referral_links (code TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        conn.commit()
+        _sqlite_conn = conn
+    
+    return _sqlite_conn
+
+def _sqlite_load() -> Optional[Dict]:
+    """Baca seluruh database dari SQLite, None jika masih kosong"""
+    global _DIRTY_ALL
+    
+    conn = _sqlite()
+    kv = {key: _loads(value) for key, value in conn.execute("SELECT key, value FROM kv")}
+    if not kv:
+        return None
+    
+    schema = get_database_schema()
+    db = {key: kv.get(key, schema[key]) for key in ("stats", "referrals", "meta")}
+    db["users"] = {user_id: _loads(data) for user_id, data in conn.execute("SELECT user_id, data FROM users")}
+    
+    # Kode referral disimpan per baris; data lama masih menyimpannya di dalam blob "referrals"
+    legacy_links = db["referrals"].pop("active_links", None)
+    db["referrals"]["active_links"] = {code: _loads(data) for code, data in conn.execute("SELECT code, data FROM referral_links")}
+    if legacy_links:
+        db["referrals"]["active_links"].update(legacy_links)
+    
+    _DIRTY_ALL = _migrate_timestamps(db) or legacy_links is not None
+    db["meta"]["updated_at"] = _now_ts()
+    return db
+
+def _sqlite_rows(db: Dict) -> Tuple[List[Tuple[str, bytes]], List[Tuple[str, bytes]], List[Tuple[str, bytes]]]:
+    """Serialize baris yang berubah jadi baris tabel users, referral_links dan kv"""
+    global _DIRTY_ALL
+    
+    active_links = db["referrals"]["active_links"]
+    if _DIRTY_ALL:
+        user_ids, codes = db["users"].keys(), active_links.keys()
+    else:
+        user_ids, codes = _DIRTY_USERS, _DIRTY_LINKS
+    
+    users = [(user_id, _dumps(db["users"][user_id])) for user_id in user_ids if user_id in db["users"]]
+    links = [(code, _dumps(active_links[code])) for code in codes if code in active_links]
+    
+    # Stats, meta dan counter referral kecil, selalu ditulis
+    referrals = {key: value for key, value in db["referrals"].items() if key != "active_links"}
+    kv = [("stats", _dumps(db["stats"])), ("referrals", _dumps(referrals)), ("meta", _dumps(db["meta"]))]
+    
+    _DIRTY_USERS.clear()
+    _DIRTY_LINKS.clear()
+    _DIRTY_ALL = False
+    return users, links, kv
+
+def _sqlite_write(rows: Tuple[List[Tuple[str, bytes]], List[Tuple[str, bytes]], List[Tuple[str, bytes]]]) -> bool:
+    """Tulis baris yang berubah ke SQLite dalam satu transaksi"""
+    users, links, kv = rows
+    try:
+        with _sqlite() as conn:
+            conn.executemany("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)", users)
+            conn.executemany("INSERT OR REPLACE INTO referral_links (code, data) VALUES (?, ?)", links)
+            conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", kv)
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving database: {str(e)}")
+        return False
+
+def _sqlite_backup() -> bool:
+    """Backup database SQLite memakai online backup API"""
+    backup_folder = CONFIG["storage"]["backup_folder"]
+    os.makedirs(backup_folder, exist_ok=True)
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_file = os.path.join(backup_folder, f"backup_{timestamp}.sqlite3")
+    
+    try:
+        dst = sqlite3.connect(backup_file)
+        try:
+            _sqlite().backup(dst)
+        finally:
+            dst.close()
+        logger.info(f"Database backup created: {backup_file}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Backup failed: {str(e)}")
+        return False
+
 # ============== USER MANAGEMENT ==============
 
+def find_user(user_id: int) -> Optional[Dict]:
+    """Cari data user di database tanpa membuat entry baru"""
+    return load_database()["users"].get(str(user_id))
+
 def get_user_data(user_id: int) -> Dict:
     """Mendapatkan data user, buat entry baru jika belum ada"""
     db = load_database()
@@ -216,7 +558,7 @@ def get_user_data(user_id: int) -> Dict:
         user_data["user_id"] = user_id_str
         db["users"][user_id_str] = user_data
         db["stats"]["total_users"] += 1
-        save_database(db)
+        save_database(db, (user_id_str,))
     else:
         user_data = db["users"][user_id_str]
         
@@ -230,45 +572,47 @@ def get_user_data(user_id: int) -> Dict:
                 user_data["remaining_limit"] = CONFIG["features"]["daily_limit"]
             user_data["last_reset_date"] = today
             db["users"][user_id_str] = user_data
-            save_database(db)
+            save_database(db, (user_id_str,))
     
     return user_data
 
 def update_user_data(user_id: int, update_data: Dict) -> bool:
     """Update data user di database"""
     db = load_database()
-    user_id_str = str(user_id)
     
-    if user_id_str in db["users"]:
-        # Update hanya field yang ada di update_data
-        for key, value in update_data.items():
-            if key in db["users"][user_id_str]:
-                if isinstance(value, dict) and isinstance(db["users"][user_id_str][key], dict):
-                    # Nested update untuk dictionary
-                    db["users"][user_id_str][key].update(value)
-                else:
-                    db["users"][user_id_str][key] = value
-        
-        return save_database(db)
+    if _apply_user_update(db, str(user_id), update_data):
+        return save_database(db, (user_id,))
     else:
         logger.warning(f"Attempted to update non-existent user: {user_id}")
         return False
 
-def get_user_role(user_id: int) -> str:
-    """Mendapatkan role user (owner, admin, moderator, vip, user)"""
-    user_id_int = int(user_id)
+def _apply_user_update(db: Dict, user_id_str: str, update_data: Dict) -> bool:
+    """Terapkan update ke data user di db yang sudah dimuat, returns False jika user tidak ada"""
+    if user_id_str not in db["users"]:
+        return False
     
-    # Cek role dari konfigurasi
-    for role, data in CONFIG["users"].items():
-        if user_id_int in data["user_ids"]:
-            return role
+    # Update hanya field yang ada di update_data
+    for key, value in update_data.items():
+        if key in db["users"][user_id_str]:
+            if isinstance(value, dict) and isinstance(db["users"][user_id_str][key], dict):
+                # Nested update untuk dictionary
+                db["users"][user_id_str][key].update(value)
+            else:
+                db["users"][user_id_str][key] = value
     
-    # Jika tidak ada di konfigurasi, cek dari database
-    db = load_database()
-    user_id_str = str(user_id)
+    return True
+
+def get_user_role(user_id: int) -> str:
+    """Mendapatkan role user (owner, admin, moderator, vip, user)"""
+    # Cek role dari konfigurasi (index dibangun sekali di config)
+    role = ROLE_BY_USER.get(int(user_id))
+    if role is not None:
+        return role
     
-    if user_id_str in db["users"]:
-        return db["users"][user_id_str].get("role", "user")
+    # Jika tidak ada di konfigurasi, cek dari database di memory
+    user_data = find_user(user_id)
+    if user_data is not None:
+        return user_data.get("role", "user")
     
     return "user"  # Default role
 
@@ -281,22 +625,27 @@ def has_permission(user_id: int, permission: str) -> bool:
         return True
     
     # Cek permission berdasarkan role
-    if role in CONFIG["users"]:
-        return permission in CONFIG["users"][role]["permissions"] or "all" in CONFIG["users"][role]["permissions"]
+    permissions = PERMISSIONS_BY_ROLE.get(role)
+    if permissions is not None:
+        return permission in permissions or "all" in permissions
     
     return False  # Default tidak memiliki permission
 
+@contextmanager
+def mutate_user(user_id: int) -> Iterator[Dict]:
+    """Ubah data user langsung di database yang sudah dimuat, simpan sekali saat keluar dari blok"""
+    user_data = get_user_data(user_id)
+    yield user_data
+    save_database(load_database(), (user_id,))
+
 def modify_user_limit(user_id: int, amount: int) -> Tuple[bool, int]:
     """Modify limit user (tambah/kurang), returns (success, new_limit)"""
-    user_data = get_user_data(user_id)
-    
-    # Hitung limit baru (tidak boleh negatif)
-    new_limit = max(0, user_data["remaining_limit"] + amount)
+    with mutate_user(user_id) as user_data:
+        # Hitung limit baru (tidak boleh negatif)
+        new_limit = max(0, user_data["remaining_limit"] + amount)
+        user_data["remaining_limit"] = new_limit
     
-    # Update database
-    success = update_user_data(user_id, {"remaining_limit": new_limit})
-    
-    return success, new_limit
+    return True, new_limit
 
 def update_user_stats(user_id: int, user_data: Dict) -> None:
     """Update statistik user setelah generate gambar"""
@@ -309,57 +658,67 @@ def update_user_stats(user_id: int, user_data: Dict) -> None:
     user_id_str = str(user_id)
     update_top_list(db, "top_users", user_id_str, user_data, "total_generations")
     
-    save_database(db)
+    save_database(db, (user_id_str,))
+
+def update_user_and_stats(user_id: int, user_data: Dict) -> bool:
+    """Update data user dan statistik generate sekaligus dengan satu kali tulis database"""
+    db = load_database()
+    user_id_str = str(user_id)
+    
+    if not _apply_user_update(db, user_id_str, user_data):
+        logger.warning(f"Attempted to update non-existent user: {user_id}")
+        return False
+    
+    # Update total generasi global dan top users
+    db["stats"]["total_generations"] += 1
+    update_top_list(db, "top_users", user_id_str, user_data, "total_generations")
+    
+    return save_database(db, (user_id_str,))
 
 def update_top_list(db: Dict, list_name: str, user_id: str, user_data: Dict, sort_key: str, max_entries: int = 10) -> None:
     """Update daftar top users berdasarkan kriteria tertentu"""
+    entries = db["stats"].setdefault(list_name, [])
+    
     # Cari user di list
-    found = False
-    for user in db["stats"][list_name]:
-        if user["user_id"] == user_id:
-            user[sort_key] = user_data[sort_key]
-            user["username"] = user_data["username"]
-            user["first_name"] = user_data["first_name"]
-            found = True
-            break
-    
-    # Jika tidak ditemukan, tambahkan ke list
-    if not found:
-        db["stats"][list_name].append({
+    index = next((i for i, user in enumerate(entries) if user["user_id"] == user_id), None)
+    
+    # Fast path: list sudah penuh dan skor user belum melewati entry terakhir, tidak ada yang berubah
+    if index is None and len(entries) >= max_entries and user_data[sort_key] <= entries[-1][sort_key]:
+        return
+    
+    if index is not None:
+        # Keluarkan dulu dari list, nanti disisipkan lagi di posisi barunya
+        entry = entries.pop(index)
+        entry[sort_key] = user_data[sort_key]
+        entry["username"] = user_data["username"]
+        entry["first_name"] = user_data["first_name"]
+    else:
+        # Jika tidak ditemukan, tambahkan ke list
+        entry = {
             "user_id": user_id,
             "username": user_data["username"],
             "first_name": user_data["first_name"],
             "last_name": user_data.get("last_name", ""),
             sort_key: user_data[sort_key]
-        })
-    
-    # Urutkan list berdasarkan sort_key (descending)
-    db["stats"][list_name] = sorted(
-        db["stats"][list_name], 
-        key=lambda x: x[sort_key], 
-        reverse=True
-    )
+        }
     
-    # Batasi jumlah entries
-    db["stats"][list_name] = db["stats"][list_name][:max_entries]
+    # List selalu terurut descending berdasarkan sort_key, cukup sisipkan di posisinya
+    bisect.insort(entries, entry, key=lambda item: -item[sort_key])
+    del entries[max_entries:]
 
 # ============== REFERRAL SYSTEM ==============
 
+# Key hash referral dari nama bot (blake2b menerima key maksimal 64 byte)
+_REF_HASH_KEY = CONFIG["bot"]["name"].encode()[:64]
+
 def generate_referral_code(user_id: int) -> str:
     """Generate kode referral unik untuk user"""
-    # Combine user_id with timestamp and salt for uniqueness
-    salt = CONFIG["bot"]["name"] + str(time.time())
-    data = f"{user_id}:{salt}"
+    # Combine user_id with timestamp, nama bot dipakai sebagai key hash
+    data = f"{user_id}:{time.time()}"
     
-    # Generate a short hash
-    hash_obj = hashlib.md5(data.encode())
-    hash_digest = hash_obj.digest()
-    
-    # Convert to base64 and make URL-safe
-    code = base64.urlsafe_b64encode(hash_digest).decode('utf-8')
-    
-    # Take first 8 characters for a shorter code
-    return code[:8]
+    # 6 byte digest = tepat 8 karakter base64 URL-safe (tanpa padding)
+    hash_digest = hashlib.blake2b(data.encode(), digest_size=6, key=_REF_HASH_KEY).digest()
+    return base64.urlsafe_b64encode(hash_digest).decode('utf-8')
 
 def create_referral_link(user_id: int) -> str:
     """Buat atau dapatkan link referral untuk user"""
@@ -372,38 +731,32 @@ def create_referral_link(user_id: int) -> str:
         # Generate kode baru
         ref_code = generate_referral_code(user_id)
         
-        # Update user data
+        # Update user data (langsung di database yang sudah dimuat, disimpan sekali di bawah)
         user_data["referral"]["referral_code"] = ref_code
-        user_data["referral"]["link_created_at"] = datetime.now().isoformat()
-        update_user_data(user_id, {"referral": user_data["referral"]})
+        user_data["referral"]["link_created_at"] = _now_ts()
         
         # Simpan kode ke daftar referral aktif
         db["referrals"]["active_links"][ref_code] = {
             "user_id": user_id_str,
-            "created_at": datetime.now().isoformat(),
+            "created_at": _now_ts(),
             "uses": 0
         }
-        save_database(db)
+        _REF_CODE_INDEX[ref_code] = user_id_str
+        save_database(db, (user_id_str,), (ref_code,))
     
     # Format link referral
-    link_format = CONFIG["referral"]["referral_link_format"]
-    return link_format.format(
-        bot_username=CONFIG["bot"]["username"],
-        user_id=user_id,
-        ref_code=user_data["referral"]["referral_code"]
-    )
+    return build_referral_link(user_id)
 
 def process_referral(referee_id: int, ref_code: str) -> Tuple[bool, Optional[Dict]]:
     """Proses referral dan berikan bonus, returns (success, referrer_data)"""
-    db = load_database()
+    if _DB_CACHE is None:
+        load_database()
     
     # Periksa apakah kode referral valid
-    if ref_code not in db["referrals"]["active_links"]:
+    referrer_id = _REF_CODE_INDEX.get(ref_code)
+    if referrer_id is None:
         return False, None
     
-    referral_info = db["referrals"]["active_links"][ref_code]
-    referrer_id = referral_info["user_id"]
-    
     # Periksa apakah referee mencoba menggunakan referral miliknya sendiri
     if str(referee_id) == referrer_id:
         return False, None
@@ -413,24 +766,30 @@ def process_referral(referee_id: int, ref_code: str) -> Tuple[bool, Optional[Dic
     if referee_data["referral"]["referred_by"]:
         return False, None
     
-    # Berikan bonus kepada referee
-    referee_bonus = CONFIG["referral"]["referee_bonus"]
-    modify_user_limit(referee_id, referee_bonus)
+    # Pastikan data referrer ada dan limit hariannya sudah di-reset
+    get_user_data(int(referrer_id))
     
-    # Update data referee
+    # Semua perubahan diterapkan ke db yang sudah dimuat, lalu disimpan sekali
+    db = load_database()
+    referrer_data = _apply_referral(db, str(referee_id), referrer_id, ref_code)
+    
+    save_database(db, (referee_id, referrer_id), (ref_code,))
+    return True, referrer_data
+
+def _apply_referral(db: Dict, referee_id: str, referrer_id: str, ref_code: str) -> Dict:
+    """Terapkan bonus dan statistik referral langsung ke db (tanpa load/save), returns data referrer"""
+    referee_data = db["users"][referee_id]
+    referrer_data = db["users"][referrer_id]
+    
+    # Berikan bonus kepada referee
+    _modify_user_limit_inplace(db, referee_id, CONFIG["referral"]["referee_bonus"])
     referee_data["referral"]["referred_by"] = referrer_id
-    update_user_data(referee_id, {"referral": referee_data["referral"]})
     
     # Berikan bonus kepada referrer
-    referrer_bonus = CONFIG["referral"]["referrer_bonus"]
-    referrer_data = get_user_data(int(referrer_id))
-    modify_user_limit(int(referrer_id), referrer_bonus)
-    
-    # Update data referrer
-    if str(referee_id) not in referrer_data["referral"]["referred_users"]:
-        referrer_data["referral"]["referred_users"].append(str(referee_id))
+    _modify_user_limit_inplace(db, referrer_id, CONFIG["referral"]["referrer_bonus"])
+    if referee_id not in referrer_data["referral"]["referred_users"]:
+        referrer_data["referral"]["referred_users"].append(referee_id)
     referrer_data["referral"]["total_referrals"] += 1
-    update_user_data(int(referrer_id), {"referral": referrer_data["referral"]})
     
     # Update statistik referral
     db["referrals"]["active_links"][ref_code]["uses"] += 1
@@ -439,23 +798,28 @@ def process_referral(referee_id: int, ref_code: str) -> Tuple[bool, Optional[Dic
     # Berikan bonus tambahan jika mencapai threshold
     min_uses = CONFIG["referral"]["min_uses_for_extra_bonus"]
     if not referrer_data["referral"]["bonus_claimed"] and len(referrer_data["referral"]["referred_users"]) >= min_uses:
-        extra_bonus = CONFIG["referral"]["extra_bonus"]
-        modify_user_limit(int(referrer_id), extra_bonus)
+        _modify_user_limit_inplace(db, referrer_id, CONFIG["referral"]["extra_bonus"])
         referrer_data["referral"]["bonus_claimed"] = True
-        update_user_data(int(referrer_id), {"referral": referrer_data["referral"]})
     
-    # Update top referrers
-    update_top_list(db, "top_referrers", referrer_id, referrer_data, "total_referrals")
+    # Update top referrers (total_referrals ada di dalam data referral)
+    update_top_list(db, "top_referrers", referrer_id,
+                    {**referrer_data, "total_referrals": referrer_data["referral"]["total_referrals"]},
+                    "total_referrals")
     
-    save_database(db)
-    return True, referrer_data
+    return referrer_data
+
+def _modify_user_limit_inplace(db: Dict, user_id: str, amount: int) -> int:
+    """Tambah/kurangi limit user langsung di db (tidak boleh negatif), returns limit baru"""
+    user_data = db["users"][user_id]
+    user_data["remaining_limit"] = max(0, user_data["remaining_limit"] + amount)
+    return user_data["remaining_limit"]
 
 def extract_referral_code(start_parameter: str) -> Optional[str]:
     """Ekstrak kode referral dari parameter start"""
     if start_parameter and start_parameter.startswith("ref_"):
-        parts = start_parameter.split("_")
-        if len(parts) >= 2:
-            return parts[1]
+        # Ambil bagian setelah "ref_" sampai "_" berikutnya tanpa membuat list hasil split
+        end = start_parameter.find("_", 4)
+        return start_parameter[4:end] if end >= 0 else start_parameter[4:]
     return None
 
 def get_referrer_name(user_id: int) -> str:
@@ -470,39 +834,56 @@ def get_referrer_name(user_id: int) -> str:
 
 # ============== HELPER FUNCTIONS ==============
 
-def format_time_ago(timestamp_str: Optional[str]) -> str:
-    """Format waktu 'xxx yang lalu' dari timestamp"""
-    if not timestamp_str:
+def _now_ts() -> float:
+    """Timestamp sekarang dalam epoch detik (format penyimpanan semua field *_at)"""
+    return time.time()
+
+def format_time_ago(timestamp: Optional[float]) -> str:
+    """Format waktu 'xxx yang lalu' dari epoch detik"""
+    if not timestamp:
         return "Belum pernah"
     
     try:
-        timestamp = datetime.fromisoformat(timestamp_str)
-        now = datetime.now()
-        delta = now - timestamp
-        
-        if delta.days > 30:
-            months = delta.days // 30
-            return f"{months} bulan yang lalu"
-        elif delta.days > 0:
-            return f"{delta.days} hari yang lalu"
-        elif delta.seconds >= 3600:
-            return f"{delta.seconds // 3600} jam yang lalu"
-        elif delta.seconds >= 60:
-            return f"{delta.seconds // 60} menit yang lalu"
-        else:
-            return f"{delta.seconds} detik yang lalu"
-    except (ValueError, TypeError):
+        elapsed = int(time.time() - timestamp)
+    except (ValueError, TypeError, OverflowError):
         return "Waktu tidak valid"
+    
+    # Bulatkan ke satuan terbesar yang ditampilkan, jadi key cache cuma beberapa ratus nilai
+    if elapsed >= 86400:
+        elapsed -= elapsed % 86400
+    elif elapsed >= 3600:
+        elapsed -= elapsed % 3600
+    elif elapsed >= 60:
+        elapsed -= elapsed % 60
+    return _format_elapsed(elapsed)
+
+def _parse_iso(ts: str) -> datetime:
+    """Parse timestamp ISO dari data lama (hanya dipakai migrasi saat load)"""
+    return datetime.fromisoformat(ts)
+
+@lru_cache(maxsize=1024)
+def _format_elapsed(elapsed: int) -> str:
+    """Format durasi (detik) jadi teks 'xxx yang lalu'"""
+    days, seconds = divmod(elapsed, 86400)
+    
+    if days > 30:
+        months = days // 30
+        return f"{months} bulan yang lalu"
+    elif days > 0:
+        return f"{days} hari yang lalu"
+    elif seconds >= 3600:
+        return f"{seconds // 3600} jam yang lalu"
+    elif seconds >= 60:
+        return f"{seconds // 60} menit yang lalu"
+    else:
+        return f"{seconds} detik yang lalu"
 
 def is_in_allowed_group(chat_id: int) -> bool:
     """Cek apakah chat berada di grup yang diizinkan"""
-    for group in CONFIG["channels"]["allowed_groups"]:
-        if chat_id == group["id"]:
-            return True
-    return False
+    return chat_id in ALLOWED_GROUP_IDS
 
-def get_allowed_groups_text() -> str:
-    """Dapatkan teks grup yang diizinkan untuk ditampilkan"""
+def _build_allowed_groups_text() -> str:
+    """Rangkai teks grup yang diizinkan dari konfigurasi"""
     groups = CONFIG["channels"]["allowed_groups"]
     group_links = []
     
@@ -514,8 +895,8 @@ def get_allowed_groups_text() -> str:
     
     return "\n".join(group_links)
 
-def get_required_channels_text() -> str:
-    """Dapatkan teks channel yang diperlukan untuk ditampilkan"""
+def _build_required_channels_text() -> str:
+    """Rangkai teks channel yang diperlukan dari konfigurasi"""
     channels = CONFIG["channels"]["required_channels"]
     channel_links = []
     
@@ -531,6 +912,18 @@ def get_required_channels_text() -> str:
     
     return "\n".join(channel_links)
 
+# Konfigurasi channel/grup read-only, jadi teksnya cukup dirangkai sekali saat import
+_ALLOWED_GROUPS_TEXT = _build_allowed_groups_text()
+_REQUIRED_CHANNELS_TEXT = _build_required_channels_text()
+
+def get_allowed_groups_text() -> str:
+    """Dapatkan teks grup yang diizinkan untuk ditampilkan"""
+    return _ALLOWED_GROUPS_TEXT
+
+def get_required_channels_text() -> str:
+    """Dapatkan teks channel yang diperlukan untuk ditampilkan"""
+    return _REQUIRED_CHANNELS_TEXT
+
 def resize_image(img_path: str, max_size: int = 512) -> str:
     """Mengubah ukuran gambar dan mengembalikan path gambar yang baru"""
     # Implementasi fungsi ini menggunakan PIL/Pillow
@@ -538,24 +931,16 @@ def resize_image(img_path: str, max_size: int = 512) -> str:
     
     try:
         with Image.open(img_path) as img:
-            # Hitung rasio aspek untuk mempertahankan proporsi
-            width, height = img.size
-            aspect_ratio = width / height
-            
-            if width > height:
-                new_width = min(width, max_size)
-                new_height = int(new_width / aspect_ratio)
-            else:
-                new_height = min(height, max_size)
-                new_width = int(new_height * aspect_ratio)
+            # JPEG langsung di-decode di resolusi yang lebih kecil (no-op untuk format lain)
+            img.draft("RGB", (max_size, max_size))
             
-            # Resize gambar
-            resized_img = img.resize((new_width, new_height), Image.LANCZOS)
+            # Resize dengan proporsi tetap, reduksi box cepat dulu sebelum filter bicubic
+            img.thumbnail((max_size, max_size), Image.Resampling.BICUBIC, reducing_gap=2.0)
             
             # Simpan dengan path baru
             filename, ext = os.path.splitext(img_path)
             resized_path = f"{filename}_resized{ext}"
-            resized_img.save(resized_path)
+            img.save(resized_path)
             
             return resized_path
     except Exception as e: